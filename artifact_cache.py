@@ -0,0 +1,86 @@
+import os
+import json
+import pickle
+import hashlib
+import logging
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def file_digest(file, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    f.close()
+    return digest.hexdigest()
+
+
+def code_version(*modules):
+    # hash of the sources of the given modules of this package, a stage is recomputed when its code changes
+    root = os.path.dirname(os.path.abspath(__file__))
+    return hashlib.sha256(''.join(file_digest(os.path.join(root, f'{module}.py')) for module in modules)
+                          .encode('ascii')).hexdigest()
+
+
+class ArtifactCache:
+    # stage results stored under the sha256 of everything they depend on; the least recently used results are
+    # evicted once the cache grows beyond max_bytes, 0 keeps everything
+    def __init__(self, root, max_bytes=0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stats = {}
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, stage, dependencies):
+        return hashlib.sha256(json.dumps([stage, dependencies], sort_keys=True, default=str).encode()).hexdigest()
+
+    def path(self, stage, key):
+        return os.path.join(self.root, f'{stage}_{key}.pkl')
+
+    def load(self, stage, key):
+        stats = self.stats.setdefault(stage, {'hits': 0, 'misses': 0})
+        file = self.path(stage, key)
+        if not os.path.exists(file):
+            stats['misses'] += 1
+            return False, None
+        with open(file, 'rb') as f:
+            value = pickle.load(f)
+        f.close()
+        os.utime(file)
+        stats['hits'] += 1
+        return True, value
+
+    def save(self, stage, key, value):
+        file = self.path(stage, key)
+        with open(file + '.tmp', 'wb') as f:
+            pickle.dump(value, f)
+        f.close()
+        os.replace(file + '.tmp', file)
+        self.evict(keep=file)
+
+    def entries(self):
+        files = [os.path.join(self.root, name) for name in os.listdir(self.root) if name.endswith('.pkl')]
+        return sorted(((os.path.getmtime(file), os.path.getsize(file), file) for file in files))
+
+    def evict(self, keep=None):
+        if not self.max_bytes:
+            return
+        entries = self.entries()
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, file in entries:
+            if size <= self.max_bytes:
+                break
+            if file == keep:
+                continue
+            os.remove(file)
+            size -= file_size
+            logger.info(f'Evicted {os.path.basename(file)} from stage cache.')
+
+    def report(self):
+        for stage, stats in self.stats.items():
+            logger.info(f"Stage cache {stage}: {stats['hits']} hits, {stats['misses']} misses.")
+        entries = self.entries()
+        size = sum(entry[1] for entry in entries) / 2 ** 20
+        logger.info(f'Stage cache holds {len(entries)} results, {size: .1f} MB.')
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+import tracemalloc
+import numpy as np
+from preprocess import Processor
+from graph_utils import get_nodes, merge_nodes
+from synthetic_layout import generate_layout
+from artifact_cache import code_version
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+STAGES = ['extraction', 'omp', 'encoding', 'ga', 'post']
+
+parser = argparse.ArgumentParser(description='Benchmarks of the pipeline stages on synthetic layouts.')
+parser.add_argument('--widths', type=int, nargs='+', default=[4410, 8819], help='strip widths in pixels')
+parser.add_argument('--strips', type=int, nargs='+', default=[3], help='numbers of strips')
+parser.add_argument('--library_sizes', type=int, nargs='+', default=[40], help='numbers of standard cells')
+parser.add_argument('--mirror', type=float, default=0.5, help='probability that a placed cell is mirrored')
+parser.add_argument('--noise', type=float, default=0.05,
+                    help='probability that a contact is widened or shifted by a pixel')
+parser.add_argument('--population_size', type=int, default=200, help='population size for GA')
+parser.add_argument('--max_iter', type=int, default=50, help='maximum number of iterations for GA')
+parser.add_argument('--patience', type=int, default=0,
+                    help='GA generations without a coverage gain after which a strip stops, 0 disables it')
+parser.add_argument('--ga_engine', type=str, default='legacy', choices=['legacy', 'span'],
+                    help='population engine of the GA')
+parser.add_argument('--ga_workers', type=int, default=1, help='number of worker processes for GA')
+parser.add_argument('--workers', type=int, default=1, help='number of worker processes for encoding strips')
+parser.add_argument('--seed', type=int, default=0, help='seed of the layout generator and the GA')
+parser.add_argument('--no_memory', action='store_true',
+                    help='skip the second, traced run of every scenario that records peak memory')
+parser.add_argument('--work_dir', type=str, default='', help='dir for layouts and outputs, a temporary dir if empty')
+parser.add_argument('--output', type=str, default='./benchmark_results.json', help='file for the results')
+parser.add_argument('--baseline', type=str, default='', help='results of an earlier version to compare against')
+
+
+def make_config(args, root):
+    return {'dataRoot': os.path.join(root, 'data'),
+            'design': 'synthetic',
+            'node': 32,
+            'layout': '',
+            'stripHeight': 0,
+            'clearRails': False,
+            'increment': 5,
+            'ompBlockSize': 0,
+            'ompMode': 'streaming',
+            'n_components': 0,
+            'sweepComponents': [],
+            'workers': args.workers,
+            'layoutCache': False,
+            'stageCache': '',
+            'stageCacheSize': 0,
+            'storage': 'binary',
+            'storageCompress': False,
+            'encodingPath': os.path.join(root, 'encodings'),
+            'resultPath': os.path.join(root, 'results'),
+            'populationSize': args.population_size,
+            'upperSize': 40,
+            'lowerSize': 3,
+            'GA_threshold': 0.90,
+            'maxIter': args.max_iter,
+            'patience': args.patience,
+            'minDelta': 0.0,
+            'stripTimeBudget': 0,
+            'timeBudget': 0,
+            'gaWorkers': args.ga_workers,
+            'migrationInterval': 50,
+            'seed': args.seed,
+            'gaEngine': args.ga_engine,
+            'cacheSize': 100000,
+            'checkpointInterval': 0,
+            'metricsFormat': 'json',
+            'profileStages': [],
+            'profiler': 'cprofile'}
+
+
+def run_stages(processor, seed, trace=False):
+    # every stage is timed on its own, under tracemalloc its peak allocation is recorded as well
+    random.seed(seed)
+    np.random.seed(seed)
+    metrics = {}
+    outputs = {}
+
+    def measure(stage, compute):
+        if trace:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = compute()
+        metrics[stage] = {'seconds': time.perf_counter() - wall, 'cpuSeconds': time.process_time() - cpu}
+        if trace:
+            metrics[stage]['peakBytes'] = tracemalloc.get_traced_memory()[1] - base
+        return result
+
+    unique_columns, counts = measure('extraction', processor.extract_columns)
+    selection = measure('omp', lambda: processor.select_columns(unique_columns, counts))
+    processor.n_components = selection['n_components']
+    encoding = measure('encoding', lambda: processor.encode_strips(selection['column_dict']))
+    cells = measure('ga', lambda: processor.search(encoding))
+    nodes = measure('post', lambda: merge_nodes(encoding, get_nodes(encoding, cells)))
+
+    outputs['uniqueColumns'] = int(unique_columns.shape[1])
+    outputs['nComponents'] = int(selection['n_components'])
+    outputs['encodingLength'] = len(encoding)
+    outputs['cells'] = len(cells)
+    outputs['nodes'] = len(nodes)
+    return metrics, outputs
+
+
+def run_scenario(args, root, width, n_strips, n_cells):
+    logger.info(f'Benchmarking {n_strips} strips of width {width} with a library of {n_cells} cells...')
+    config = make_config(args, root)
+    generate_layout(config['dataRoot'], config['design'], config['node'], n_strips, width, n_cells, args.seed,
+                    args.mirror, args.noise)
+    metrics, outputs = run_stages(Processor(config), args.seed)
+    if not args.no_memory:
+        tracemalloc.start()
+        traced, _ = run_stages(Processor(config), args.seed, trace=True)
+        tracemalloc.stop()
+        for stage in STAGES:
+            metrics[stage]['peakBytes'] = traced[stage]['peakBytes']
+    for stage in STAGES:
+        logger.info(f"{stage}: {metrics[stage]['seconds']: .2f}s"
+                    + (f", peak {metrics[stage]['peakBytes'] / 2 ** 20: .1f} MB" if 'peakBytes' in metrics[stage]
+                       else ''))
+    return {'width': width, 'strips': n_strips, 'librarySize': n_cells, 'stages': metrics, 'outputs': outputs}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file):
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)
+    f.close()
+    previous = {(s['width'], s['strips'], s['librarySize']): s for s in baseline['scenarios']}
+    for scenario in results['scenarios']:
+        old = previous.get((scenario['width'], scenario['strips'], scenario['librarySize']))
+        if old is None:
+            continue
+        for stage in STAGES:
+            ratio = scenario['stages'][stage]['seconds'] / max(old['stages'][stage]['seconds'], 1e-9)
+            logger.info(f"{scenario['width']}x{scenario['strips']}, {scenario['librarySize']} cells, {stage}: "
+                        f"{ratio: .2f}x the time of {baseline.get('revision') or baseline_file}")
+
+
+def run_benchmarks(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='benchmark_')
+    results = {'revision': git_revision(),
+               'code': code_version('preprocess', 'strips', 'omp', 'token_encoding', 'ga', 'utils', 'text_index',
+                                    'substring_index', 'graph_utils'),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': sys.version.split()[0],
+               'numpy': np.__version__,
+               'platform': platform.platform(),
+               'settings': {key: value for key, value in vars(args).items() if key not in ['output', 'baseline']},
+               'scenarios': []}
+    for width, n_strips, n_cells in itertools.product(args.widths, args.strips, args.library_sizes):
+        root = os.path.join(work_dir, f'{width}_{n_strips}_{n_cells}')
+        results['scenarios'].append(run_scenario(args, root, width, n_strips, n_cells))
+        if not args.work_dir:
+            shutil.rmtree(root)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    f.close()
+    logger.info(f'Benchmark results saved to {args.output}.')
+    if args.baseline:
+        compare(results, args.baseline)
+    if not args.work_dir:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    run_benchmarks(parser.parse_args())
@@ -0,0 +1,211 @@
+import os
+import time
+import pickle
+import random
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from utils import generate_population, count_frequency, batch_fitness, nextPopulation
+from utils import remove_substrings, find_non_overlapping_strings
+from text_index import OccurrenceIndex
+from memo import LRUCache
+from population import SpanPopulation, span_rng
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+worker_layout = {}
+
+
+def span_engine(encoding, encoding_index, settings):
+    if settings.get('engine', 'legacy') != 'span':
+        return None
+    return SpanPopulation(encoding, encoding_index, settings['sizeBounds'])
+
+
+def init_search(strip, encoding, settings, cells, engine=None, seed=None):
+    if engine is not None:
+        # the span engine draws from its own generator, kept in the state so that checkpoints resume it
+        rng = span_rng(seed)
+        spans = engine.generate(settings['populationSize'], cells, rng)
+        population = engine.strings(*spans)
+        return {'strip': strip, 'population': population, 'best_population': population, 'spans': spans,
+                'best_spans': spans, 'rng': rng, 'evals': [-np.inf], 'epoch': 0}
+    population = generate_population(settings['populationSize'], encoding, settings['sizeBounds'], cells)
+    return {'strip': strip, 'population': population, 'best_population': population, 'evals': [-np.inf], 'epoch': 0}
+
+
+def stop_reason(state, settings, deadline=None):
+    # policies in order of precedence; patience counts generations since the last gain above minDelta, the strip
+    # budget the search seconds of the strip and the deadline is the wall-clock end of the budget of all strips
+    if state['evals'][-1] > settings['threshold']:
+        return 'threshold'
+    if state['epoch'] > settings['maxIter']:
+        return 'max_iter'
+    if settings['patience'] and state.get('stall', 0) >= settings['patience']:
+        return 'patience'
+    if settings['stripTimeBudget'] and state.get('searchSeconds', 0) >= settings['stripTimeBudget']:
+        return 'strip_time_budget'
+    if deadline is not None and time.time() >= deadline:
+        return 'time_budget'
+    return None
+
+
+def finished(state, settings, deadline=None):
+    state['stopReason'] = stop_reason(state, settings, deadline)
+    return state['stopReason'] is not None
+
+
+def evolve(state, encoding, image_encodings, layout_index, encoding_index, settings, generations=np.inf,
+           engine=None, deadline=None):
+    population, best_population = state['population'], state['best_population']
+    spans, best_spans = state.get('spans'), state.get('best_spans')
+    evals = state['evals']
+    # convergence trace of (iteration, coverage) at every improvement
+    trace = state.setdefault('trace', [])
+
+    while generations > 0 and not finished(state, settings, deadline):
+        wall = time.perf_counter()
+        frequencies = count_frequency(population, image_encodings, layout_index)
+        information_coverage, updated_encoding = batch_fitness(encoding, population, frequencies, encoding_index)
+
+        # gains of at most minDelta still update the best population but do not reset patience
+        stall = 0 if information_coverage - evals[-1] > settings['minDelta'] else state.get('stall', 0) + 1
+        if information_coverage > evals[-1]:
+            evals.append(information_coverage)
+            trace.append([state['epoch'], information_coverage])
+            logger.info(f"Improved information coverage: {information_coverage: 04f} at iteration {state['epoch']}")
+            best_population, best_spans = population, spans
+
+        if engine is not None:
+            spans = engine.next_generation(settings['populationSize'], *best_spans, state['rng'])
+            population = engine.strings(*spans)
+        else:
+            population = nextPopulation(settings['populationSize'], best_population, settings['sizeBounds'],
+                                        encoding, index=encoding_index)
+        state.update({'epoch': state['epoch'] + 1, 'stall': stall,
+                      'searchSeconds': state.get('searchSeconds', 0) + time.perf_counter() - wall})
+        generations -= 1
+
+    state.update({'population': population, 'best_population': best_population, 'evals': evals})
+    if engine is not None:
+        state.update({'spans': spans, 'best_spans': best_spans})
+    return state
+
+
+def save_checkpoint(checkpoint, file):
+    # written next to the target and renamed over it, an interrupted write never leaves a truncated checkpoint
+    with open(file + '.tmp', 'wb') as f:
+        pickle.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    f.close()
+    os.replace(file + '.tmp', file)
+
+
+def load_checkpoint(file, mode, n_strips, settings):
+    if file is None or not os.path.exists(file):
+        return None
+    with open(file, 'rb') as f:
+        checkpoint = pickle.load(f)
+    f.close()
+    if checkpoint['mode'] != mode or checkpoint['n_strips'] != n_strips or checkpoint['settings'] != settings:
+        logger.info(f'Checkpoint {file} was written by a different search, starting over.')
+        return None
+    return checkpoint
+
+
+def strip_cells(best_population, encoding, encoding_index):
+    return remove_substrings(find_non_overlapping_strings(best_population,
+                                                          count_frequency(best_population, encoding, encoding_index)))
+
+
+def init_ga_worker(image_encodings, cache_size):
+    cache = LRUCache(cache_size)
+    worker_layout.update({'image_encodings': image_encodings,
+                          'encodings': image_encodings.split('\t')[:-1],
+                          'cache': cache,
+                          'layout_index': OccurrenceIndex(image_encodings, cache=cache, name='layout'),
+                          'encoding_indexes': {},
+                          'engines': {}})
+
+
+def run_island(strip, state, migrants, settings, generations, seed, deadline=None):
+    # one migration round of the GA on a single strip, seeded per strip and round for reproducibility
+    random.seed(seed)
+    wall, cpu = time.perf_counter(), time.process_time()
+    cache = worker_layout['cache']
+    hits, misses = cache.hits, cache.misses
+    encoding = worker_layout['encodings'][strip]
+    if strip not in worker_layout['encoding_indexes']:
+        worker_layout['encoding_indexes'][strip] = OccurrenceIndex(encoding, cache=cache, name=strip)
+        worker_layout['engines'][strip] = span_engine(encoding, worker_layout['encoding_indexes'][strip], settings)
+    encoding_index = worker_layout['encoding_indexes'][strip]
+    engine = worker_layout['engines'][strip]
+
+    if state is None:
+        state = init_search(strip, encoding, settings, migrants, engine, seed)
+    else:
+        present = set(state['population'])
+        migrants = [m for m in migrants if m not in present]
+        if engine is not None:
+            # migrants join as spans where they occur in this strip
+            starts, lengths = engine.spans_of(migrants)
+            state['spans'] = (np.concatenate([state['spans'][0], starts]),
+                              np.concatenate([state['spans'][1], lengths]))
+            migrants = engine.strings(starts, lengths)
+        state['population'] = state['population'] + migrants
+
+    state = evolve(state, encoding, worker_layout['image_encodings'], worker_layout['layout_index'], encoding_index,
+                   settings, generations, engine, deadline)
+    state['cells'] = strip_cells(state['best_population'], encoding, encoding_index)
+    state['cacheHits'], state['cacheMisses'] = cache.hits - hits, cache.misses - misses
+    state['totalCacheHits'] = state.get('totalCacheHits', 0) + state['cacheHits']
+    state['totalCacheMisses'] = state.get('totalCacheMisses', 0) + state['cacheMisses']
+    state['seconds'] = state.get('seconds', 0) + time.perf_counter() - wall
+    state['cpuSeconds'] = state.get('cpuSeconds', 0) + time.process_time() - cpu
+    return state
+
+
+def island_search(image_encodings, settings, workers, migration_interval=50, n_migrants=None, seed=0,
+                  cache_size=100000, checkpoint_file=None, checkpoint_interval=0, deadline=None):
+    # every strip is an island; after each round of migration_interval generations the cells found so far
+    # are merged and the most frequent ones migrate into every island that is still searching
+    encodings = image_encodings.split('\t')[:-1]
+    layout_index = OccurrenceIndex(image_encodings)
+    n_migrants = settings['populationSize'] // 10 if n_migrants is None else n_migrants
+
+    states = [None] * len(encodings)
+    cells = []
+    migration_round = 0
+    # islands are reseeded every round, so the round number is all the random state a checkpoint needs
+    mode = f'island:{migration_interval}:{seed}'
+    checkpoint = load_checkpoint(checkpoint_file, mode, len(encodings), settings)
+    if checkpoint is not None:
+        states, cells, migration_round = checkpoint['states'], checkpoint['cells'], checkpoint['round']
+        logger.info(f'Resuming island search from checkpoint at migration round {migration_round}.')
+    saved_round = migration_round
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_ga_worker,
+                             initargs=(image_encodings, cache_size)) as pool:
+        while True:
+            active = [i for i, state in enumerate(states) if state is None or not finished(state, settings, deadline)]
+            if not active:
+                break
+            logger.info(f'Migration round {migration_round}: {len(active)} islands searching, {len(cells)} cells shared.')
+            migrants = sorted(cells, key=lambda cell: (-layout_index.count(cell), cell))[:n_migrants]
+            results = pool.map(run_island, active, [states[i] for i in active], [migrants] * len(active),
+                               [settings] * len(active), [migration_interval] * len(active),
+                               [f'{seed}:{i}:{migration_round}' for i in active], [deadline] * len(active))
+            hits, misses = 0, 0
+            for i, state in zip(active, results):
+                states[i] = state
+                hits, misses = hits + state['cacheHits'], misses + state['cacheMisses']
+            logger.info(f'Memo cache: {hits} hits, {misses} misses in round {migration_round}.')
+            cells = sorted(set().union(*(state['cells'] for state in states if state is not None)))
+            migration_round += 1
+            if checkpoint_file and checkpoint_interval and \
+                    (migration_round - saved_round) * migration_interval >= checkpoint_interval:
+                save_checkpoint({'mode': mode, 'n_strips': len(encodings), 'settings': settings,
+                                 'states': states, 'cells': cells, 'round': migration_round}, checkpoint_file)
+                saved_round = migration_round
+    return cells, states
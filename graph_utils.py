@@ -2,14 +2,20 @@ import networkx as nx
 import matplotlib.pyplot as plt
 from collections import Counter
 from collections import defaultdict
+from bisect import bisect_left
 from utils import count_frequency
+from text_index import OccurrenceIndex
+from substring_index import SubstringIndex
 import re
 import logging
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def parent_string_checker(list_of_strings, test_string):
+def parent_string_checker(list_of_strings, test_string, index=None):
+    # index is a SubstringIndex over list_of_strings
+    if index is not None:
+        return index.has_parent(test_string)
     for string in list_of_strings:
         if test_string in string and len(string) > len(test_string):
             return True
@@ -25,6 +31,7 @@ def group_substrings(strings):
 
     # Set to track which strings have been grouped
     grouped = set()
+    index = SubstringIndex(strings)
 
     for i, string in enumerate(strings):
         # If the string is already grouped, skip it
@@ -36,10 +43,10 @@ def group_substrings(strings):
         grouped.add(string)
 
         # Check for substrings in the remaining strings
-        for other_string in strings[i + 1:]:
-            if other_string not in grouped and string in other_string:
-                group.append(other_string)
-                grouped.add(other_string)
+        for j in index.containing(string):
+            if j > i and strings[j] not in grouped:
+                group.append(strings[j])
+                grouped.add(strings[j])
 
         # Add the group to the result
         group.sort(key=len, reverse=True)
@@ -48,37 +55,145 @@ def group_substrings(strings):
     return list(groups.values())
 
 
-def createPathGraph(s, nodes):
-    path = []
-    i = 0
-    s_copy = s[:]
-    while i < len(s):
+class PathTokenizer:
+    # character trie over the nodes; at every position the matching node that comes first in nodes is taken,
+    # which is the longest match when nodes are sorted by length as everywhere in this module
+    def __init__(self, nodes, longest=False):
+        # with longest set the longest matching node is taken whatever the order, so nodes can be added later
+        self.longest = longest
+        self.n_nodes = 0
+        self.children = [{}]
+        self.priority = [None]
+        self.terminal = [None]
         for node in nodes:
-            if s.startswith(node, i):
-                path.append(node)
-                i += len(node)
-                s_copy = s_copy[len(node):]
+            self.add(node)
+
+    def add(self, node):
+        rank = -len(node) if self.longest else self.n_nodes
+        self.n_nodes += 1
+        state = 0
+        for char in node:
+            if char not in self.children[state]:
+                self.children[state][char] = len(self.children)
+                self.children.append({})
+                self.priority.append(None)
+                self.terminal.append(None)
+            state = self.children[state][char]
+        if self.priority[state] is None:
+            self.priority[state], self.terminal[state] = rank, node
+
+    def match(self, s, i):
+        # node taken at position i and the position after it, None when no node starts there
+        children, priority = self.children, self.priority
+        state, best, end, j, n = 0, None, i, i, len(s)
+        while j < n:
+            state = children[state].get(s[j])
+            if state is None:
                 break
-        else:
-            i += 1  # Increment i if no node is found to avoid infinite loop
-
-    # Create path graph using NetworkX
-    G = nx.path_graph(path, create_using=nx.DiGraph())
-    # Add edges to graph and count occurrences
-    edges = [(path[i], path[i + 1]) for i in range(len(path) - 1)]
-    edge_counts = Counter(edges)
-
-    # Add edges with weights (degree)
-    for edge, count in edge_counts.items():
-        G.add_edge(edge[0], edge[1], weight=count)
+            j += 1
+            if priority[state] is not None and (best is None or priority[state] < priority[best]):
+                best, end = state, j
+        return (None, i) if best is None else (self.terminal[best], end)
+
+    def tokenize(self, s, starts=None):
+        path = []
+        i, n = 0, len(s)
+        while i < n:
+            node, end = self.match(s, i)
+            if node is None:
+                i += 1  # Increment i if no node is found to avoid infinite loop
+            else:
+                path.append(node)
+                if starts is not None:
+                    starts.append(i)
+                i = end
+        return path
 
-    # Map nodes to numbers for labeling
-    node_map = dict(zip(nodes, range(len(nodes))))
 
+def high_degree_edges(edge_counts):
     # Find edges with degree greater than 1
     high_degree_edges = [(edge, count) for edge, count in edge_counts.items() if count > 0 and '\t' not in edge]
-    high_degree_edges = sorted(high_degree_edges, key=lambda x: x[1], reverse=True)
-    return path, G, high_degree_edges, edge_counts
+    return sorted(high_degree_edges, key=lambda x: x[1], reverse=True)
+
+
+def createPathGraph(s, nodes, build_graph=True, tokenizer=None):
+    tokenizer = PathTokenizer(nodes) if tokenizer is None else tokenizer
+    path = tokenizer.tokenize(s)
+
+    # Add edges to graph and count occurrences
+    edge_counts = Counter(zip(path, path[1:]))
+
+    G = None
+    if build_graph:
+        # Create path graph using NetworkX
+        G = nx.path_graph(path, create_using=nx.DiGraph())
+        # Add edges with weights (degree)
+        for edge, count in edge_counts.items():
+            G.add_edge(edge[0], edge[1], weight=count)
+
+    return path, G, high_degree_edges(edge_counts), edge_counts
+
+
+class PathMerger:
+    # the greedy path of text over nodes with its token counts, kept up to date as merged nodes are added
+    # instead of tokenizing the whole text again after every merge
+    def __init__(self, text, nodes, index):
+        self.text = text
+        self.index = index
+        self.longest = all(len(a) >= len(b) for a, b in zip(nodes, nodes[1:]))
+        self.tokenizer = PathTokenizer(nodes, longest=self.longest)
+        self.starts = []
+        self.path = self.tokenizer.tokenize(text, self.starts)
+        self.token_counts = Counter(self.path)
+
+    def edges(self):
+        return high_degree_edges(Counter(zip(self.path, self.path[1:])))
+
+    def add(self, node, nodes):
+        # nodes is the sorted node list node was added to, the path is then the longest match everywhere
+        if not self.longest:
+            self.__init__(self.text, nodes, self.index)
+            return
+        self.tokenizer.add(node)
+        path, starts = self.path, self.starts
+        new_path, new_starts = [], []
+        k, cursor = 0, 0
+        for p in self.index.positions(node).tolist():
+            if p < cursor:
+                continue
+            # the path only changes where node starts at a token boundary and is longer than the token there,
+            # or where it starts on a character that no token covered
+            first = bisect_left(starts, p, k)
+            if first < len(starts) and starts[first] == p:
+                if len(path[first]) >= len(node):
+                    continue
+            elif first > 0 and starts[first - 1] + len(path[first - 1]) > p:
+                continue
+            new_path.extend(path[k:first])
+            new_starts.extend(starts[k:first])
+            window = len(new_path)
+
+            # tokenize again from p until the new path meets a token boundary of the old one
+            i, k = p, first
+            while i < len(self.text):
+                token, end = self.tokenizer.match(self.text, i)
+                if token is None:
+                    i += 1
+                else:
+                    new_path.append(token)
+                    new_starts.append(i)
+                    i = end
+                k = bisect_left(starts, i, k)
+                if k < len(starts) and starts[k] == i:
+                    break
+            self.token_counts.subtract(path[first:k])
+            self.token_counts.update(new_path[window:])
+            cursor = i
+
+        new_path.extend(path[k:])
+        new_starts.extend(starts[k:])
+        self.path, self.starts = new_path, new_starts
+        self.token_counts = +self.token_counts
 
 
 def get_nodes(image_encodings, final_words):
@@ -86,12 +201,13 @@ def get_nodes(image_encodings, final_words):
     final_words = sorted(final_words, key=len, reverse=True)
     encoding_copy = image_encodings[:]
 
+    index = OccurrenceIndex(image_encodings)
     potentials = []
     for word in final_words:
         reversed_word = ''.join(re.findall('...', word)[::-1])
-        if word in image_encodings:
+        if index.contains(word):
             potentials.append(word)
-        if reversed_word in image_encodings:
+        if index.contains(reversed_word):
             potentials.append(word)
 
     # potentials = [word for word in final_words if word in image_encodings]
@@ -99,7 +215,7 @@ def get_nodes(image_encodings, final_words):
     groups = group_substrings(potentials)
     filtered = []
     for group in groups:
-        frequency = count_frequency(group, image_encodings)
+        frequency = count_frequency(group, image_encodings, index)
         filtered.append((group[frequency.index(max(frequency))], max(frequency)))
 
     filtered_words = []
@@ -120,13 +236,15 @@ def get_nodes(image_encodings, final_words):
     nodes = sorted(list(set(filtered_words)), key=len, reverse=True)
     nodes.extend(['\t'])
 
+    tokenizer = PathTokenizer(nodes)
     for encoding in encodings:
-        path, G, high_edge, edge_counts = createPathGraph(encoding, nodes)
+        path = tokenizer.tokenize(encoding)
         a = ''.join(path)
 
         if a != encoding:
             missed_node = list(set(re.findall('...', a)) ^ set(re.findall('...', encoding)))
             nodes.extend(missed_node)
+            tokenizer = PathTokenizer(nodes)
 
     nodes = sorted(nodes, key=len, reverse=True)
     return nodes
@@ -134,43 +252,49 @@ def get_nodes(image_encodings, final_words):
 
 def merge_nodes(image_encodings, nodes):
     encoding_copy = image_encodings[:]
-    new_path = []
-    path, _, high_edge, _ = createPathGraph(encoding_copy, nodes)
+    index = OccurrenceIndex(image_encodings)
+    merger = PathMerger(encoding_copy, nodes, index)
+    substrings = SubstringIndex(nodes)
+    new_path, path = set(), set(merger.token_counts)
 
-    while set(new_path) != set(path):
+    while new_path != path:
         # logger.info('========================')
         final_results = []
-        path, _, high_edge, _ = createPathGraph(encoding_copy, nodes)
-        for edge in high_edge:
+        path = set(merger.token_counts)
+        node_counts = merger.token_counts
+        for edge in merger.edges():
             in_node, out_node = edge[0][0], edge[0][1]
-            in_node_freq, out_node_freq = path.count(in_node), path.count(out_node)
+            in_node_freq, out_node_freq = node_counts[in_node], node_counts[out_node]
             merged_nodes = ''.join([in_node, out_node])
-            merged_nodes_freq = image_encodings.count(merged_nodes)
 
-            if in_node == out_node and parent_string_checker(nodes, in_node):
+            if in_node == out_node and parent_string_checker(nodes, in_node, substrings):
                 if merged_nodes not in nodes:
                     logger.info(f'Merging repeated nodes - {in_node} and {out_node}')
                     nodes.append(merged_nodes)
+                    substrings.add(merged_nodes)
 
                     nodes = sorted(nodes, key=len, reverse=True)
-                    new_path, G, high_edge, edge_counts = createPathGraph(encoding_copy, nodes)
+                    merger.add(merged_nodes, nodes)
+                    new_path = set(merger.token_counts)
                     break
 
-            elif in_node == out_node and not parent_string_checker(nodes, in_node):
+            elif in_node == out_node and not parent_string_checker(nodes, in_node, substrings):
                 if in_node not in final_results:
                     final_results.append(in_node)
                 continue
 
             elif in_node != out_node and in_node not in final_results and out_node not in final_results:
+                merged_nodes_freq = index.count(merged_nodes)
                 if merged_nodes_freq >= in_node_freq or merged_nodes_freq >= out_node_freq:
                     logger.info(f'Merging node - {in_node} and {out_node}')
                     nodes.append(merged_nodes)
+                    substrings.add(merged_nodes)
 
                     nodes = sorted(nodes, key=len, reverse=True)
-                    new_path, G, high_edge, edge_counts = createPathGraph(encoding_copy, nodes)
+                    merger.add(merged_nodes, nodes)
+                    new_path = set(merger.token_counts)
                     break
 
-        if set(new_path) == set(path):
+        if new_path == path:
             break
     return nodes
-
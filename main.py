@@ -1,6 +1,7 @@
 import logging
 import argparse
 from preprocess import Processor
+from profiling import PROFILED_STAGES
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -10,8 +11,34 @@ parser = argparse.ArgumentParser(description='Parameters for pipeline.')
 parser.add_argument('--data_root', type=str, default='./data', help='Data root directory')
 parser.add_argument('--design', type=str, default='des', help='layout design')
 parser.add_argument('--node', type=int, default=32, help='node technology')
+parser.add_argument('--layout', type=str, default='',
+                    help='full layout image, e.g. ./data/layouts/design_CO_des_32nm.bmp, cut into strips when the '
+                         'strip dir of the design is empty')
+parser.add_argument('--strip_height', type=int, default=0,
+                    help='height of strips cut from --layout, 0 uses the most common rail pitch')
+parser.add_argument('--clear_rails', action='store_true',
+                    help='blank the detected VCC rails in strips cut from --layout, 32nm strips lose theirs on loading')
 parser.add_argument('--increment', type=int, default=5, help='increment for OMP')
+parser.add_argument('--omp_block_size', type=int, default=0,
+                    help='block size for OMP similarity, 0 materializes the full similarity matrix')
+parser.add_argument('--omp_mode', type=str, default='streaming', choices=['streaming', 'legacy'],
+                    help='streaming stops OMP at the info capture plateau and saves one column ranking, '
+                         'legacy saves a column dictionary every increment')
 parser.add_argument('--n_components', type=int, default=0, help='number of selected columns')
+parser.add_argument('--sweep_components', type=int, nargs='*', default=[],
+                    help='dictionary sizes to write layout encodings for in one pass over the strips, instead of '
+                         'running the pipeline; a later run with --n_components picks one of them')
+parser.add_argument('--workers', type=int, default=1, help='number of worker processes for encoding strips')
+parser.add_argument('--layout_cache', action='store_true',
+                    help='keep a memory-mapped bit-packed copy of the strips for column extraction')
+parser.add_argument('--stage_cache', type=str, default='',
+                    help='dir of a content-addressed cache of stage results, stages are then rerun only when their '
+                         'inputs, parameters or code change')
+parser.add_argument('--stage_cache_size', type=int, default=4096,
+                    help='size in MB above which least recently used stage results are evicted, 0 keeps all')
+parser.add_argument('--storage', type=str, default='binary', choices=['binary', 'pickle'],
+                    help='format of saved encodings, column dictionaries and results, pickles are always readable')
+parser.add_argument('--storage_compress', action='store_true', help='zlib-compress binary artifacts')
 parser.add_argument('--encodingPath', type=str, default='./encodings', help='dir for saving encodings')
 parser.add_argument('--resultPath', type=str, default='./results', help='dir for saving results')
 parser.add_argument('--population_size', type=int, default=200, help='population size for GA')
@@ -19,26 +46,84 @@ parser.add_argument('--upper_size', type=int, default=40, help='upper size bound
 parser.add_argument('--lower_size', type=int, default=3, help='lower size bound for GA')
 parser.add_argument('--GA_threshold', type=int, default=0.90, help='random seed')
 parser.add_argument('--max_iter', type=int, default=1000, help='maximum number of iterations for GA')
+parser.add_argument('--patience', type=int, default=0,
+                    help='GA generations without a coverage gain above --min_delta after which a strip stops, '
+                         '0 disables it')
+parser.add_argument('--min_delta', type=float, default=0.0,
+                    help='smallest coverage gain that resets the --patience window')
+parser.add_argument('--strip_time_budget', type=float, default=0,
+                    help='seconds of GA search after which a strip stops, 0 disables it')
+parser.add_argument('--time_budget', type=float, default=0,
+                    help='seconds of GA search shared by all strips, strips still searching when it runs out stop, '
+                         '0 disables it')
+parser.add_argument('--ga_workers', type=int, default=1,
+                    help='number of worker processes for GA, more than one runs every strip as a parallel island')
+parser.add_argument('--migration_interval', type=int, default=50,
+                    help='generations between migrations of shared cells across GA islands')
+parser.add_argument('--seed', type=int, default=0, help='random seed for GA islands and the span engine')
+parser.add_argument('--ga_engine', type=str, default='legacy', choices=['legacy', 'span'],
+                    help='span builds every GA generation with array operations on (start, length) spans of the '
+                         'strip, seeded by --seed; legacy keeps the string operators of utils')
+parser.add_argument('--cache_size', type=int, default=100000,
+                    help='entries of the LRU memo of GA frequencies and occurrences, 0 disables it')
+parser.add_argument('--checkpoint_interval', type=int, default=50,
+                    help='GA generations between checkpoints that an interrupted search resumes from, 0 disables them')
+parser.add_argument('--metrics_format', type=str, default='json', choices=['json', 'csv'],
+                    help='format of the per-stage metrics saved next to the results')
+parser.add_argument('--profile_stages', type=str, nargs='*', default=[], choices=PROFILED_STAGES,
+                    help='stages to profile in the main process, worker processes are not profiled; profiles are '
+                         'saved under results/{design}_{node}nm/profiles')
+parser.add_argument('--profiler', type=str, default='cprofile', choices=['cprofile', 'sampling'],
+                    help='cprofile saves .prof files for pstats or snakeviz, sampling saves collapsed stacks for '
+                         'flame graphs at a lower overhead')
 
 args = parser.parse_args()
 
 config = {'dataRoot': args.data_root,
           'design': args.design,
           'node': args.node,
+          'layout': args.layout,
+          'stripHeight': args.strip_height,
+          'clearRails': args.clear_rails,
           'increment': args.increment,
+          'ompBlockSize': args.omp_block_size,
+          'ompMode': args.omp_mode,
           'n_components': args.n_components,
+          'sweepComponents': args.sweep_components,
+          'workers': args.workers,
+          'layoutCache': args.layout_cache,
+          'stageCache': args.stage_cache,
+          'stageCacheSize': args.stage_cache_size,
+          'storage': args.storage,
+          'storageCompress': args.storage_compress,
           'encodingPath': args.encodingPath,
           'resultPath': args.resultPath,
           'populationSize': args.population_size,
           'upperSize': args.upper_size,
           'lowerSize': args.lower_size,
           'GA_threshold': args.GA_threshold,
-          'maxIter': args.max_iter}
+          'maxIter': args.max_iter,
+          'patience': args.patience,
+          'minDelta': args.min_delta,
+          'stripTimeBudget': args.strip_time_budget,
+          'timeBudget': args.time_budget,
+          'gaWorkers': args.ga_workers,
+          'migrationInterval': args.migration_interval,
+          'seed': args.seed,
+          'gaEngine': args.ga_engine,
+          'cacheSize': args.cache_size,
+          'checkpointInterval': args.checkpoint_interval,
+          'metricsFormat': args.metrics_format,
+          'profileStages': args.profile_stages,
+          'profiler': args.profiler}
 
 
 def run_preprocess():
     processor = Processor(config)
-    processor.post_processing()
+    if config['sweepComponents']:
+        processor.sweep_encodings()
+    else:
+        processor.post_processing()
 
 
 if __name__ == '__main__':
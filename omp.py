@@ -1,36 +1,82 @@
 import pickle
-from scipy.spatial.distance import hamming
 import numpy as np
-from tqdm import tqdm
 import os
+from storage import binary_file, write_column_dict
 
 
-def extract_columns(image):
-    matrix = np.transpose(image).tolist()
-    tuple_list = [tuple(lst) for lst in matrix]
-    unique_tuples = set(tuple_list)
-    unique_lists = [list(tup) for tup in unique_tuples]
+def pack_columns(image):
+    # one row of uint64 words per image column, bit i of the column is pixel row i
+    bits = np.packbits(np.asarray(image) != 0, axis=0)
+    pad = -bits.shape[0] % 8
+    if pad:
+        bits = np.pad(bits, ((0, pad), (0, 0)))
+    return np.ascontiguousarray(bits.T).view(np.uint64)
+
+
+def unpack_columns(packed, height):
+    bits = np.unpackbits(np.ascontiguousarray(packed).view(np.uint8), axis=1)
+    return bits[:, :height].T
+
+
+def column_keys(packed):
+    packed = np.ascontiguousarray(packed)
+    return packed.view(np.dtype((np.void, packed.dtype.itemsize * packed.shape[1]))).ravel()
+
 
-    unique_columns = np.transpose(np.array(unique_lists))
-    unique_columns = np.delete(unique_columns, np.where(np.sum(unique_columns, axis=0) == 0)[0][0], axis=1)
+def count_columns(packed, offset=0):
+    _, first, counts = np.unique(column_keys(packed), return_index=True, return_counts=True)
+    return packed[first], counts, first + offset
 
-    filtered_unique_columns = []
-    counts = []
-    for column in tqdm(unique_columns.T, desc='Extraction columns'):
-        mirrored_column = column[::-1]
 
-        representative = column if np.sum(np.all(image == column.reshape(-1, 1), axis=0)) >= np.sum(
-            np.all(image == mirrored_column.reshape(-1, 1), axis=0)) else mirrored_column
-        matches = np.sum(np.all(image == column.reshape(-1, 1), axis=0)) + np.sum(
-            np.all(image == mirrored_column.reshape(-1, 1), axis=0))
+def merge_column_counts(parts):
+    packed = np.concatenate([part[0] for part in parts])
+    _, index, inverse = np.unique(column_keys(packed), return_index=True, return_inverse=True)
+    counts = np.zeros(len(index), dtype=np.int64)
+    np.add.at(counts, inverse.ravel(), np.concatenate([part[1] for part in parts]))
+    first = np.full(len(index), np.iinfo(np.int64).max)
+    np.minimum.at(first, inverse.ravel(), np.concatenate([part[2] for part in parts]))
+    return packed[index], counts, first
 
-        if list(column) not in filtered_unique_columns and list(mirrored_column) not in filtered_unique_columns:
-            filtered_unique_columns.append(list(representative))
-            counts.append(matches)
 
-    filtered_unique_columns = np.transpose(np.array(filtered_unique_columns))
-    counts = np.array(counts) / np.sum(counts)
-    return filtered_unique_columns, counts
+def extract_packed_columns(chunks, height, merge_every=16):
+    # chunks are consecutive packed column blocks of the layout, e.g. one per strip
+    parts = []
+    offset = 0
+    for packed in chunks:
+        packed = np.asarray(packed)
+        parts.append(count_columns(packed, offset))
+        offset += packed.shape[0]
+        if len(parts) >= merge_every:
+            parts = [merge_column_counts(parts)]
+    unique_packed, counts, first = merge_column_counts(parts)
+
+    # keep unique columns in order of their first appearance in the layout
+    order = np.argsort(first, kind='stable')
+    unique_packed, counts = unique_packed[order], counts[order]
+
+    # locate the vertical mirror of every unique column among the unique columns
+    mirrored_packed = pack_columns(unpack_columns(unique_packed, height)[::-1])
+    keys, mirrored_keys = column_keys(unique_packed), column_keys(mirrored_packed)
+    sorter = np.argsort(keys)
+    pos = np.minimum(np.searchsorted(keys, mirrored_keys, sorter=sorter), len(keys) - 1)
+    mirror = sorter[pos]
+    has_mirror = keys[mirror] == mirrored_keys
+
+    # a column and its mirror collapse onto one canonical entry, the earlier of the pair
+    canonical = np.where(has_mirror, np.minimum(np.arange(len(keys)), mirror), np.arange(len(keys)))
+    matches = counts + np.where(has_mirror, counts[mirror], 0)
+    representative = np.where(has_mirror & (counts[mirror] > counts), mirror, np.arange(len(keys)))
+
+    groups = np.unique(canonical)
+    groups = groups[np.any(unique_packed[groups] != 0, axis=1)]
+    return unique_packed[representative[groups]], matches[groups] / np.sum(matches[groups])
+
+
+def extract_columns(image):
+    image = np.asarray(image)
+    packed, counts = extract_packed_columns([pack_columns(image)], image.shape[0])
+    fill = image.max() if image.size else 1
+    return unpack_columns(packed, image.shape[0]).astype(np.int64) * fill, counts
 
 
 def encode_base62(num):
@@ -45,56 +91,224 @@ def encode_base62(num):
     return encoding
 
 
-def OMP(unique_columns, counts, encodingDir, design, node_tech, increment=1):
+def hamming_distance(packed_a, packed_b):
+    # number of differing bits between every packed column of packed_a and every packed column of packed_b
+    distance = np.zeros((packed_a.shape[0], packed_b.shape[0]), dtype=np.int64)
+    for word in range(packed_a.shape[1]):
+        distance += np.bitwise_count(packed_a[:, word, None] ^ packed_b[None, :, word])
+    return distance
+
+
+def hamming_similarity(packed_a, packed_b, n_bits):
+    return 1 - hamming_distance(packed_a, packed_b) / n_bits
+
+
+def similarity_blocks(packed, n_bits, block_size=1024):
+    for start in range(0, packed.shape[0], block_size):
+        stop = min(start + block_size, packed.shape[0])
+        yield start, stop, hamming_similarity(packed[start:stop], packed, n_bits)
+
+
+def similarity_matrix(packed, n_bits, block_size=1024):
+    matrix = np.empty((packed.shape[0], packed.shape[0]))
+    for start, stop, block in similarity_blocks(packed, n_bits, block_size):
+        matrix[start:stop] = block
+    return matrix
+
+
+def similarity_range(packed, n_bits, block_size=1024):
+    lowest, highest = np.inf, -np.inf
+    for _, _, block in similarity_blocks(packed, n_bits, block_size):
+        lowest, highest = min(lowest, np.min(block)), max(highest, np.max(block))
+    return lowest, highest
+
+
+def build_column_dict(unique_columns, indices):
+    column_dict = {}
+    for i in range(len(indices)):
+        column_dict[tuple(unique_columns[:, indices[i]])] = encode_base62(i)
+    return column_dict
+
+
+def select_n_components(coverage, n_columns, increment, tolerance=0.001):
+    coverage = np.array(coverage)
+    dy = coverage[1:] - coverage[:-1]
+    pt = np.where(dy <= tolerance)[0][0]
+    x = range(10, n_columns, increment)
+    return x[pt]
+
+
+def OMP(unique_columns, counts, encodingDir, design, node_tech, increment=1, block_size=0, streaming=False,
+        binary=False, min_components=0):
     counts = counts.reshape(-1, 1)
-    corr_matrix = np.zeros((unique_columns.shape[1], unique_columns.shape[1]))
-    for x in range(unique_columns.shape[1]):
-        for y in range(unique_columns.shape[1]):
-            similarity = 1 - hamming(unique_columns[:, x], unique_columns[:, y])
-            corr_matrix[x, y] = similarity
+    n_bits = unique_columns.shape[0]
+    packed = pack_columns(unique_columns)
 
-    corr_matrix = (corr_matrix - np.min(corr_matrix)) / (np.max(corr_matrix) - np.min(corr_matrix))
+    if block_size:
+        # blocked mode: similarity columns are computed on demand, the U x U matrix is never built
+        corr_min, corr_max = similarity_range(packed, n_bits, block_size)
+    else:
+        corr_matrix = similarity_matrix(packed, n_bits)
+        corr_matrix = (corr_matrix - np.min(corr_matrix)) / (np.max(corr_matrix) - np.min(corr_matrix))
     # corr_matrix_copy = corr_matrix.copy()
 
     residual = counts
     indices = []
+    max_similarity = np.full(unique_columns.shape[1], -np.inf)
+    stop_at = None
 
     info_coverage = {'n_components': [], 'info_capture': []}
     while len(indices) <= unique_columns.shape[1]:
         indices.append(np.argmax(residual))
-        residual = counts.reshape(-1, 1) - np.multiply(counts.reshape(-1, 1),
-                                                       np.max(corr_matrix[:, indices], axis=1).reshape(-1, 1))
+        if block_size:
+            similarity = hamming_similarity(packed, packed[indices[-1]:indices[-1] + 1], n_bits)[:, 0]
+            similarity = (similarity - corr_min) / (corr_max - corr_min)
+        else:
+            similarity = corr_matrix[:, indices[-1]]
+        max_similarity = np.maximum(max_similarity, similarity)
+        residual = counts.reshape(-1, 1) - np.multiply(counts.reshape(-1, 1), max_similarity.reshape(-1, 1))
         information_capture = 1 - np.sum(residual)
         info_coverage['n_components'].append(len(indices))
         info_coverage['info_capture'].append(information_capture)
 
-        column_dict = {}
-        for i in range(len(indices)):
-            column_dict[tuple(unique_columns[:, indices[i]])] = encode_base62(i)
-
-        if len(indices) % increment == 0:
+        if streaming:
+            # stop once the plateau picked by select_n_components is reached and its coverage is recorded
+            coverage = info_coverage['info_capture']
+            if stop_at is None and len(coverage) > 1 and coverage[-1] - coverage[-2] <= 0.001:
+                candidates = range(10, unique_columns.shape[1], increment)
+                stop_at = candidates[len(coverage) - 2] if len(coverage) - 2 < len(candidates) else np.inf
+            # a sweep of dictionary sizes needs the ranking to reach its largest size
+            if stop_at is not None and len(coverage) > max(stop_at, min_components):
+                break
+        elif len(indices) % increment == 0:
             filename = os.path.join(*[encodingDir, 'column_dictionary',
                                       f'{design}_{node_tech}nm_column_dict_{len(indices)}.pkl'])
-            with open(filename, 'wb') as f:
-                pickle.dump(column_dict, f)
-            f.close()
+            if binary:
+                write_column_dict(build_column_dict(unique_columns, indices), binary_file(filename))
+            else:
+                with open(filename, 'wb') as f:
+                    pickle.dump(build_column_dict(unique_columns, indices), f)
+                f.close()
+
+    if streaming or min_components:
+        np.save(os.path.join(*[encodingDir, 'column_dictionary', f'{design}_{node_tech}nm_column_ranking.npy']),
+                np.array(indices))
+    info_coverage['ranking'] = np.array(indices)
     return info_coverage
 
 
-def encode_image(image, column_dict):
-    image_encoding = ''
-    for j in range(1, image.shape[1]):
-        if tuple(image[:, j - 1]) != tuple(image[:, j]) and np.sum(image[:, j]) != 0:
-            if tuple(image[:, j]) in column_dict.keys():
-                image_encoding += column_dict[tuple(image[:, j])]
-            elif tuple(image[:, j])[::-1] in column_dict.keys():
-                image_encoding += column_dict[tuple(image[:, j])[::-1]]
+class ColumnIndex:
+    def __init__(self, column_dict, block_size=1024):
+        self.codes = list(column_dict.values())
+        self.packed = pack_columns(np.array(list(column_dict.keys())).T)
+        self.exact = dict(zip(column_keys(self.packed).tolist(), self.codes))
+        self.block_size = block_size
+        self.memo = {}
+        self.misses = 0
+
+    def lookup(self, column):
+        return self.lookup_columns(np.asarray(column).reshape(-1, 1))[0]
+
+    def lookup_columns(self, columns):
+        columns = np.asarray(columns)
+        packed, mirrored = pack_columns(columns), pack_columns(columns[::-1])
+        keys, mirrored_keys = column_keys(packed).tolist(), column_keys(mirrored).tolist()
+
+        codes = []
+        unresolved = {}
+        for i, (key, mirrored_key) in enumerate(zip(keys, mirrored_keys)):
+            if key in self.exact:
+                codes.append(self.exact[key])
+            elif mirrored_key in self.exact:
+                codes.append(self.exact[mirrored_key])
+            elif key in self.memo:
+                codes.append(self.memo[key])
             else:
-                similarity_score = [1 - hamming(list(image[:, j]), list(k)) for k in column_dict.keys()]
-                ss_reversed = [1 - hamming(list(image[:, j])[::-1], list(k)) for k in column_dict.keys()]
-                if np.max(similarity_score) < np.max(ss_reversed):
-                    key = list(column_dict.keys())[np.argmax(ss_reversed)]
-                else:
-                    key = list(column_dict.keys())[np.argmax(similarity_score)]
-                image_encoding += column_dict[key]
-    return image_encoding
+                codes.append(None)
+                unresolved.setdefault(key, []).append(i)
+
+        # nearest dictionary column by hamming distance, the mirrored column wins only when strictly closer
+        first = [positions[0] for positions in unresolved.values()]
+        self.misses += len(first)
+        for start in range(0, len(first), self.block_size):
+            block = first[start:start + self.block_size]
+            forward = hamming_distance(packed[block], self.packed)
+            reverse = hamming_distance(mirrored[block], self.packed)
+            nearest = np.where(forward.min(axis=1) > reverse.min(axis=1), reverse.argmin(axis=1), forward.argmin(axis=1))
+            for i, k in zip(block, nearest):
+                self.memo[keys[i]] = self.codes[k]
+                for j in unresolved[keys[i]]:
+                    codes[j] = self.codes[k]
+        return codes
+
+
+def encoded_chunks(image, chunk_size=65536):
+    # a column is encoded when it differs from its left neighbour and is not empty,
+    # chunks overlap by one column so boundaries are compared against the previous chunk;
+    # column selected[i] + start of the image is row selected[i] + 1 of packed
+    for start in range(1, image.shape[1], chunk_size):
+        stop = min(start + chunk_size, image.shape[1])
+        packed = pack_columns(image[:, start - 1:stop])
+        selected = np.flatnonzero(np.any(packed[1:] != packed[:-1], axis=1) & np.any(packed[1:] != 0, axis=1))
+        yield start, packed, selected
+
+
+def encode_image(image, column_dict, chunk_size=65536):
+    index = column_dict if isinstance(column_dict, ColumnIndex) else ColumnIndex(column_dict)
+    encoding = []
+    for start, packed, selected in encoded_chunks(image, chunk_size):
+        if len(selected) == 0:
+            continue
+        _, first, inverse = np.unique(column_keys(packed[selected + 1]), return_index=True, return_inverse=True)
+        codes = np.array(index.lookup_columns(image[:, selected[first] + start]))
+        encoding.append(''.join(codes[inverse.ravel()].tolist()))
+    return ''.join(encoding)
+
+
+def encoded_columns(image, chunk_size=65536):
+    # packed columns that encode_image encodes, in layout order
+    parts = [packed[selected + 1] for _, packed, selected in encoded_chunks(image, chunk_size)]
+    return np.concatenate([np.zeros((0, -(-image.shape[0] // 64)), dtype=np.uint64)] + parts)
+
+
+class ColumnSweep:
+    # the code ColumnIndex gives every column for each prefix of a ranked column dictionary. Along the ranking the
+    # nearest dictionary column only changes at ranks where the distance drops below all earlier ones, so only
+    # those steps are kept and any prefix size is resolved by a search among them
+    def __init__(self, column_dict, packed, height, block_size=1024):
+        self.codes = np.array(list(column_dict.values()))
+        self.ranked = pack_columns(np.array(list(column_dict.keys())).T)
+        self.n_rows = packed.shape[0]
+        self.forward = self.steps(packed, block_size)
+        self.reverse = self.steps(pack_columns(unpack_columns(packed, height)[::-1]), block_size)
+
+    def steps(self, packed, block_size):
+        n_ranks = self.ranked.shape[0]
+        keys, distances = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for start in range(0, packed.shape[0], block_size):
+            distance = hamming_distance(packed[start:start + block_size], self.ranked)
+            lowest = np.minimum.accumulate(distance, axis=1)
+            step = np.ones(distance.shape, dtype=bool)
+            step[:, 1:] = lowest[:, 1:] < lowest[:, :-1]
+            rows, ranks = np.nonzero(step)
+            keys.append((rows + start) * n_ranks + ranks)
+            distances.append(distance[rows, ranks])
+        return np.concatenate(keys), np.concatenate(distances)
+
+    def nearest(self, steps, n):
+        # last step below rank n of every column, the first rank at the smallest distance within the prefix
+        keys, distances = steps
+        n_ranks = self.ranked.shape[0]
+        position = np.searchsorted(keys, np.arange(self.n_rows) * n_ranks + n) - 1
+        return keys[position] % n_ranks, distances[position]
+
+    def ranks(self, n):
+        forward_ranks, forward_distances = self.nearest(self.forward, n)
+        reverse_ranks, reverse_distances = self.nearest(self.reverse, n)
+        # the mirrored column wins only when strictly closer, exact matches are at distance 0
+        return np.where(forward_distances > reverse_distances, reverse_ranks, forward_ranks)
+
+    def encode(self, strips, n):
+        # strips hold the row of every encoded column
+        codes = self.codes[self.ranks(n)]
+        return ''.join(''.join(codes[rows].tolist()) + '\t' for rows in strips)
@@ -0,0 +1,190 @@
+import numpy as np
+from token_encoding import TokenEncoding
+from utils import selection
+
+
+def span_rng(seed):
+    # numpy generator seeded from any seed value, e.g. the '{seed}:{strip}' strings of the islands
+    return np.random.default_rng(list(str(seed).encode()))
+
+
+class SpanPopulation:
+    # GA individuals of one strip held as (start, length) spans of codes into its token array. A generation is
+    # created, mutated and bounded with array operations over all its spans and deduplicated by content with a
+    # set; the operators follow utils.nextPopulation and utils.mutation, with every random draw from rng
+    def __init__(self, encoding, index, size_bounds, bits=3, extend_length=10, diversity=0.01):
+        if not index.valid:
+            raise ValueError('The span population engine needs a code-aligned strip encoding.')
+        self.encoding = encoding
+        self.index = index
+        self.bits = bits
+        self.tokens = TokenEncoding.from_string(encoding, bits).tokens.astype(np.int64)
+        self.n = len(self.tokens)
+        self.lower = size_bounds[0]
+        self.upper = min(size_bounds[1], self.n - 1)
+        self.extend_length = extend_length
+        self.diversity = diversity
+
+    def strings(self, starts, lengths):
+        bits = self.bits
+        return [self.encoding[start * bits:(start + length) * bits]
+                for start, length in zip(starts.tolist(), lengths.tolist())]
+
+    def bounded(self, starts, lengths):
+        keep = (lengths >= self.lower) & (lengths <= self.upper) & (starts >= 0) & (starts + lengths <= self.n)
+        return starts[keep], lengths[keep]
+
+    def unique(self, starts, lengths, seen):
+        # first span of every content that is not in seen yet, seen is updated
+        keep = []
+        for i, string in enumerate(self.strings(starts, lengths)):
+            if string not in seen:
+                seen.add(string)
+                keep.append(i)
+        return starts[keep], lengths[keep]
+
+    def spans_of(self, strings):
+        # first occurrence of every string in the strip, strings that do not occur in it are dropped
+        starts, lengths = [], []
+        for string in strings:
+            positions = self.index.token_positions(string) if self.index.supports(string) else []
+            if len(positions):
+                starts.append(int(np.min(positions)))
+                lengths.append(len(string) // self.bits)
+        return np.array(starts, dtype=np.int64), np.array(lengths, dtype=np.int64)
+
+    def random_spans(self, size, rng):
+        lengths = rng.integers(self.lower, self.upper + 1, size)
+        return rng.integers(0, self.n - lengths), lengths
+
+    def fill(self, starts, lengths, size, seen, rng, attempts=10):
+        # random spans are added until size distinct contents are held, or attempts rounds brought nothing new
+        while len(starts) < size and self.upper >= self.lower and attempts > 0:
+            new_starts, new_lengths = self.unique(*self.random_spans(2 * (size - len(starts)), rng), seen)
+            attempts = attempts if len(new_starts) else attempts - 1
+            take = size - len(starts)
+            starts = np.concatenate([starts, new_starts[:take]])
+            lengths = np.concatenate([lengths, new_lengths[:take]])
+        return starts, lengths
+
+    def generate(self, size, cells, rng):
+        # cells found on earlier strips seed the population where they occur in this strip
+        starts, lengths = self.unique(*self.spans_of(cells), set())
+        return self.fill(starts, lengths, size, set(self.strings(starts, lengths)), rng)
+
+    def occurrences(self, starts, lengths, rng):
+        # a uniformly drawn occurrence of the content of every span
+        draws = rng.random(len(starts))
+        occurrences = starts.copy()
+        for i, string in enumerate(self.strings(starts, lengths)):
+            positions = self.index.token_positions(string)
+            if len(positions) > 1:
+                occurrences[i] = positions[int(draws[i] * len(positions))]
+        return occurrences
+
+    def shorten(self, starts, lengths, rng):
+        cuts = rng.integers(1, self.extend_length + 1, (4, len(starts)))
+        return (np.concatenate([starts + cuts[0], starts, starts + cuts[3]]),
+                np.concatenate([lengths - cuts[0] - cuts[1], lengths - cuts[2], lengths - cuts[3]]))
+
+    def extend(self, starts, lengths, rng):
+        positions = self.occurrences(starts, lengths, rng)
+        ends = positions + lengths
+        steps = rng.integers(1, self.extend_length + 1, (4, len(starts)))
+        new_starts = np.concatenate([np.maximum(positions - steps[0], 0), np.maximum(positions - steps[2], 0),
+                                     positions])
+        new_ends = np.concatenate([np.minimum(ends + steps[1], self.n), ends, np.minimum(ends + steps[3], self.n)])
+        return new_starts, new_ends - new_starts
+
+    def overlaps(self, left_starts, left_lengths, right_starts, right_lengths):
+        # longest k shorter than both spans such that the last k codes of left are the first k codes of right;
+        # the (span, k) pairs whose first codes agree are compared in full, all at once
+        limit = np.minimum(left_lengths, right_lengths)
+        best = np.zeros(len(left_starts), dtype=np.int64)
+        k = np.arange(1, int(limit.max(initial=1)))
+        ends = left_starts + left_lengths
+        rows, ks = np.nonzero((limit[:, None] > k) &
+                              (self.tokens[np.maximum(ends[:, None] - k, 0)] == self.tokens[right_starts][:, None]))
+        k = k[ks]
+        offsets = np.arange(int(k.max(initial=0)))
+        left = np.minimum((ends[rows] - k)[:, None] + offsets, self.n - 1)
+        right = np.minimum(right_starts[rows][:, None] + offsets, self.n - 1)
+        match = ((self.tokens[left] == self.tokens[right]) | (offsets >= k[:, None])).all(1)
+        np.maximum.at(best, rows[match], k[match])
+        return best
+
+    def merged(self, left_starts, left_lengths, right_starts, right_lengths, overlaps, rng):
+        # left and right joined on their overlap, kept only where that string occurs in the strip
+        starts, lengths = [], []
+        draws = rng.random(len(left_starts))
+        for i, (left, right) in enumerate(zip(self.strings(left_starts, left_lengths),
+                                              self.strings(right_starts, right_lengths))):
+            shift = int(left_lengths[i] - overlaps[i])
+            positions = np.intersect1d(self.index.token_positions(left) + shift,
+                                       self.index.token_positions(right)) - shift
+            if len(positions):
+                starts.append(int(positions[int(draws[i] * len(positions))]))
+                lengths.append(shift + int(right_lengths[i]))
+        return np.array(starts, dtype=np.int64), np.array(lengths, dtype=np.int64)
+
+    def mutate(self, a_starts, a_lengths, b_starts, b_lengths, rng):
+        # the children of utils.mutation for every pair of parents: parents that overlap are joined and split on
+        # their overlap, the others are shortened and extended
+        forward = self.overlaps(a_starts, a_lengths, b_starts, b_lengths)
+        backward = self.overlaps(b_starts, b_lengths, a_starts, a_lengths)
+        ahead = forward > backward
+        overlaps = np.where(ahead, forward, backward)
+        left_starts, left_lengths = np.where(ahead, a_starts, b_starts), np.where(ahead, a_lengths, b_lengths)
+        right_starts, right_lengths = np.where(ahead, b_starts, a_starts), np.where(ahead, b_lengths, a_lengths)
+
+        joined = overlaps > 0
+        left_starts, left_lengths = left_starts[joined], left_lengths[joined]
+        right_starts, right_lengths, overlaps = right_starts[joined], right_lengths[joined], overlaps[joined]
+        merged_starts, merged_lengths = self.merged(left_starts, left_lengths, right_starts, right_lengths, overlaps,
+                                                    rng)
+        apart = ~joined
+        parts = [(a_starts, a_lengths), (b_starts, b_lengths),
+                 (right_starts, overlaps), (merged_starts, merged_lengths),
+                 (left_starts, left_lengths - overlaps), (right_starts + overlaps, right_lengths - overlaps),
+                 self.shorten(a_starts[apart], a_lengths[apart], rng),
+                 self.shorten(b_starts[apart], b_lengths[apart], rng),
+                 self.extend(a_starts[apart], a_lengths[apart], rng),
+                 self.extend(b_starts[apart], b_lengths[apart], rng)]
+        return self.bounded(np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts]))
+
+    def next_generation(self, size, starts, lengths, rng, attempts=10):
+        strings = self.strings(starts, lengths)
+        frequencies = self.index.count_all(strings)
+        repeated = [i for i, frequency in enumerate(frequencies) if frequency > 1]
+        ranked = sorted(repeated, key=lambda i: (frequencies[i], strings[i]), reverse=True)
+        first = {}
+        for i in repeated:
+            first.setdefault(strings[i], i)
+        pool = np.array([first[string] for string in selection([strings[i] for i in repeated],
+                                                                [frequencies[i] for i in repeated])], dtype=np.int64)
+
+        survivors = np.array(ranked[int(self.diversity * len(ranked)):], dtype=np.int64)
+        seen = set()
+        new_starts, new_lengths = self.unique(starts[survivors], lengths[survivors], seen)
+        target = size - int(self.diversity * len(ranked))
+        while len(new_starts) < target and len(pool) and attempts > 0:
+            pairs = max(1, (target - len(new_starts)) // 6 + 1)
+            if len(pool) > 1:
+                # two distinct parents per pair, like random.sample(wordPool, k=2)
+                first_parents = rng.integers(0, len(pool), pairs)
+                second_parents = rng.integers(0, len(pool) - 1, pairs)
+                second_parents += second_parents >= first_parents
+                a, b = pool[first_parents], pool[second_parents]
+                children = self.mutate(starts[a], lengths[a], starts[b], lengths[b], rng)
+            else:
+                parents = np.repeat(pool, pairs)
+                shortened, extended = self.shorten(starts[parents], lengths[parents], rng), \
+                    self.extend(starts[parents], lengths[parents], rng)
+                children = self.bounded(np.concatenate([shortened[0], extended[0]]),
+                                        np.concatenate([shortened[1], extended[1]]))
+            child_starts, child_lengths = self.unique(*children, seen)
+            attempts = attempts if len(child_starts) else attempts - 1
+            take = target - len(new_starts)
+            new_starts = np.concatenate([new_starts, child_starts[:take]])
+            new_lengths = np.concatenate([new_lengths, child_lengths[:take]])
+        return self.fill(new_starts, new_lengths, size, seen, rng)
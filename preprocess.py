@@ -1,21 +1,49 @@
 from glob import glob
 import pickle
+import random
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 import numpy as np
 from tqdm import tqdm
 import time
-from omp import OMP, encode_image, extract_columns
+from omp import OMP, ColumnIndex, encode_image, extract_packed_columns, unpack_columns
+from omp import select_n_components, encoded_columns, column_keys, ColumnSweep, build_column_dict
+from strips import StripReader, load_strip, segment_layout
 import os
 import logging
-from utils import generate_population, count_frequency, filter_by_freq, fitness, nextPopulation
-from utils import remove_substrings, find_non_overlapping_strings
 from graph_utils import get_nodes, merge_nodes
+from text_index import OccurrenceIndex
+from memo import LRUCache
+from storage import binary_file, write_strings, read_strings
+from token_encoding import load_encoding, save_encoding
+from artifact_cache import ArtifactCache, file_digest, code_version
+from profiling import StageMetrics
+from ga import init_search, evolve, finished, strip_cells, island_search, save_checkpoint, load_checkpoint
+from ga import span_engine
 
 Image.MAX_IMAGE_PIXELS = 1616040000
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+worker_column_index = None
+
+
+def init_encoding_worker(column_dict):
+    global worker_column_index
+    worker_column_index = ColumnIndex(column_dict)
+
+
+def encode_strip(file, node_tech):
+    misses = worker_column_index.misses
+    encoding = encode_image(load_strip(file, node_tech), worker_column_index)
+    return encoding, worker_column_index.misses - misses
+
+
+def strip_columns(file, node_tech):
+    image = load_strip(file, node_tech)
+    return encoded_columns(image), image.shape[0]
+
 
 class Processor:
     def __init__(self, config):
@@ -23,6 +51,10 @@ class Processor:
         self.design = self.config['design']
         self.node_tech = self.config['node']
         self.increment = self.config['increment']
+        self.omp_block_size = self.config['ompBlockSize']
+        self.omp_mode = self.config['ompMode']
+        self.workers = self.config['workers']
+        self.layout_cache = self.config['layoutCache']
         self.start_time = time.time()
         self.dataDir = os.path.join(*[self.config['dataRoot'], f'strip_{self.design}_{self.node_tech}'])
         self.encodingDir = os.path.join(*[self.config['encodingPath'], f'{self.design}_{self.node_tech}nm'])
@@ -30,145 +62,344 @@ class Processor:
 
         self.files = glob(os.path.join(self.dataDir, '*.bmp'))
         self.n_components = self.config['n_components']
+        self.sweep_components = sorted(set(self.config['sweepComponents']))
+        # the OMP ranking has to reach an explicit dictionary size and every size of a sweep
+        self.min_components = max(self.sweep_components + [self.n_components])
 
         self.size_bounds = [self.config['lowerSize'], self.config['upperSize']]
         self.population_size = self.config['populationSize']
         self.max_iter = self.config['maxIter']
         self.threshold = self.config['GA_threshold']
+        self.ga_workers = self.config['gaWorkers']
+        self.migration_interval = self.config['migrationInterval']
+        self.seed = self.config['seed']
+        self.cache_size = self.config['cacheSize']
+        self.checkpoint_interval = self.config['checkpointInterval']
+        self.time_budget = self.config['timeBudget']
+        self.storage = self.config['storage']
+        self.storage_compress = self.config['storageCompress']
+        self.artifact_cache = None
+        if self.config['stageCache']:
+            self.artifact_cache = ArtifactCache(self.config['stageCache'], self.config['stageCacheSize'] * 2 ** 20)
+        self.stage_keys = {}
+        self.metrics_format = self.config['metricsFormat']
+        self.metrics = StageMetrics(self.config['profileStages'], self.config['profiler'],
+                                    os.path.join(self.resultDir, 'profiles'))
+        self.ga_settings = {'populationSize': self.population_size, 'sizeBounds': self.size_bounds,
+                            'threshold': self.threshold, 'maxIter': self.max_iter, 'engine': self.config['gaEngine'],
+                            'patience': self.config['patience'], 'minDelta': self.config['minDelta'],
+                            'stripTimeBudget': self.config['stripTimeBudget'], 'timeBudget': self.time_budget}
+        if self.config['gaEngine'] == 'span':
+            # the span engine is seeded, so cached cells and checkpoints of another seed must not be reused
+            self.ga_settings['seed'] = self.seed
 
         os.makedirs(self.encodingDir, exist_ok=True)
         os.makedirs(self.resultDir, exist_ok=True)
         os.makedirs(os.path.join(self.encodingDir, 'column_dictionary'), exist_ok=True)
         os.makedirs(os.path.join(self.encodingDir, 'image_encodings'), exist_ok=True)
+        if self.config['layout'] and not self.files:
+            self.files = self.segment_layout()
+
+    def segment_layout(self):
+        # strips are cut from the full layout when the strip dir holds none yet
+        logger.info(f"No strips in {self.dataDir}, segmenting {self.config['layout']}...")
+        return segment_layout(self.config['layout'], self.dataDir, self.config['stripHeight'],
+                              clear_rails=self.config['clearRails'],
+                              cache_file=os.path.join(self.encodingDir,
+                                                      f'{self.design}_{self.node_tech}nm_layout_gray.npy'))
+
+    def save_artifact(self, value, filename, write_binary):
+        # binary artifacts are written next to where the pickles were, under a .bin extension
+        if self.storage == 'binary':
+            write_binary(value, binary_file(filename), self.storage_compress)
+        else:
+            with open(filename, 'wb') as f:
+                pickle.dump(value, f)
+            f.close()
 
-    def concat_images(self):
-        logger.info('Concatenating images for processing...')
-        images = [Image.open(file) for file in self.files]
-        combined_images = Image.fromarray(np.hstack([i for i in images]))
-        image = np.array(combined_images)
-        logger.info(f'Concatenated {len(images)} images.')
-
-        if self.node_tech == 32:  # removing vcc lines in 32nm
-            image[0:5, :] = 0
-            image[-5:, :] = 0
+    def find_artifact(self, filename):
+        # the binary artifact, or the pickle written by an earlier run
+        for candidate in [binary_file(filename), filename]:
+            if os.path.exists(candidate):
+                return candidate
+        return None
+
+    def cached_stage(self, stage, dependencies, compute):
+        # the result is looked up under the hash of its dependencies, which include the key of the stage it
+        # consumes, so a changed input only recomputes the stages downstream of it
+        key = self.artifact_cache.key(stage, dependencies)
+        self.stage_keys[stage] = key
+        found, value = self.artifact_cache.load(stage, key)
+        if found:
+            logger.info(f'Stage {stage} loaded from stage cache ({key[:12]}).')
+            self.metrics.add({'stage': stage, 'cached': True})
+            return value
+        value = compute()
+        self.artifact_cache.save(stage, key, value)
+        return value
+
+    def strip_signature(self):
+        return [(os.path.basename(file), os.path.getsize(file), os.path.getmtime(file), file_digest(file))
+                for file in self.files]
+
+    def extract_columns(self):
+        # strips are streamed one at a time, the full layout is never concatenated in memory
+        cache_file = os.path.join(self.encodingDir, f'{self.design}_{self.node_tech}nm_packed_layout.npy')
+        reader = StripReader(self.files, self.node_tech, cache_file if self.layout_cache else None)
+        if self.node_tech == 32:
             logger.info(f'VCC lines are removed for {self.node_tech}nm designs')
-
-        return image
+        with self.metrics.stage('extraction') as record:
+            packed, counts = extract_packed_columns(tqdm(reader.packed_columns(), total=len(self.files),
+                                                         desc='Extracting columns'), reader.height)
+            unique_columns = unpack_columns(packed, reader.height).astype(np.int64) * reader.fill
+            record.update({'strips': len(self.files), 'columns': sum(reader.widths),
+                           'uniqueColumns': int(unique_columns.shape[1])})
+        np.save(os.path.join(self.encodingDir, f'{self.design}_{self.node_tech}nm_unique_columns.npy'),
+                unique_columns)
+        np.save(os.path.join(self.encodingDir, f'{self.design}_{self.node_tech}nm_column_counts.npy'),
+                counts)
+        return unique_columns, counts
+
+    def select_columns(self, unique_columns, counts):
+        with self.metrics.stage('omp') as record:
+            info_coverage = OMP(unique_columns, counts, self.encodingDir, self.design, self.node_tech, self.increment,
+                                self.omp_block_size, streaming=self.omp_mode == 'streaming',
+                                binary=self.storage == 'binary', min_components=self.min_components)
+            coverage, ranking = info_coverage['info_capture'], info_coverage['ranking']
+            n_components = select_n_components(coverage, unique_columns.shape[1], self.increment)
+            # built from the columns and ranking of this run, the files on disk may be those of another dataset
+            column_dict = build_column_dict(unique_columns, ranking[:n_components])
+            record.update({'uniqueColumns': int(unique_columns.shape[1]), 'nComponents': int(n_components),
+                           'ompSteps': len(coverage), 'infoCapture': float(coverage[n_components])})
+        selection = {'info_capture': coverage, 'n_components': n_components, 'column_dict': column_dict,
+                     'ranking': ranking}
+        if self.sweep_components:
+            # every size of the sweep is a prefix of the dictionary of the largest one
+            selection['sweep_dict'] = build_column_dict(
+                unique_columns, ranking[:min(self.sweep_components[-1], unique_columns.shape[1])])
+        return selection
 
     def column_selection(self):
-        image = self.concat_images()
         logger.info('Extracting all unique columns in concatnated image...')
 
-        if os.path.exists(os.path.join(self.encodingDir,  f'{self.design}_{self.node_tech}nm_unique_columns.npy')):
+        if self.artifact_cache is not None:
+            unique_columns, counts = self.cached_stage(
+                'extraction', {'strips': self.strip_signature(), 'node': self.node_tech,
+                               'code': code_version('preprocess', 'strips', 'omp')}, self.extract_columns)
+        elif os.path.exists(os.path.join(self.encodingDir,  f'{self.design}_{self.node_tech}nm_unique_columns.npy')):
             unique_columns = np.load(
                 os.path.join(self.encodingDir, f'{self.design}_{self.node_tech}nm_unique_columns.npy'))
             counts = np.load(
                 os.path.join(self.encodingDir, f'{self.design}_{self.node_tech}nm_column_counts.npy'))
         else:
-            unique_columns, counts = extract_columns(image)
-            np.save(os.path.join(self.encodingDir, f'{self.design}_{self.node_tech}nm_unique_columns.npy'),
-                    unique_columns)
-            np.save(os.path.join(self.encodingDir, f'{self.design}_{self.node_tech}nm_column_counts.npy'),
-                    counts)
+            unique_columns, counts = self.extract_columns()
 
         logger.info('Unique columns extracted. Applying OMP for column selection...')
 
-        info_coverage = OMP(unique_columns, counts, self.encodingDir, self.design, self.node_tech, self.increment)
-        coverage = info_coverage['info_capture']
+        if self.artifact_cache is not None:
+            selection = self.cached_stage(
+                'omp', {'extraction': self.stage_keys['extraction'], 'increment': self.increment,
+                        'mode': self.omp_mode, 'sweep': self.sweep_components, 'minComponents': self.min_components,
+                        'code': code_version('preprocess', 'omp')},
+                lambda: self.select_columns(unique_columns, counts))
+        else:
+            selection = self.select_columns(unique_columns, counts)
+        if self.n_components:
+            # an explicit dictionary size is used instead of the one OMP selects, as a prefix of its ranking
+            selection = {**selection, 'n_components': self.n_components,
+                         'column_dict': build_column_dict(unique_columns, selection['ranking'][:self.n_components])}
+        coverage, n_components = selection['info_capture'], selection['n_components']
         with open(os.path.join(self.encodingDir, 'info_capture.pkl'), "wb") as f:
             pickle.dump(coverage, f)
         f.close()
 
-        coverage = np.array(coverage)
-        dy = coverage[1:] - coverage[:-1]
-        pt = np.where(dy <= 0.001)[0][0]
-        x = range(10, unique_columns.shape[1], self.increment)
-        n_components = x[pt]
         info_capture = coverage[n_components] * 100
 
         logger.info(f"{n_components} columns are selected, covering {info_capture: 04f}% of column information.")
-        return n_components
+        return selection
 
     def encoding_layout(self):
-        self.n_components = self.column_selection()
+        selection = self.column_selection()
+        self.n_components, column_dict = selection['n_components'], selection['column_dict']
 
         logger.info('Initializing for encoding layout...')
-        filename = os.path.join(self.encodingDir,
-                                f'column_dictionary/{self.design}_{self.node_tech}nm_column_dict_{self.n_components}.pkl')
-        with open(filename, 'rb') as f:
-            column_dict = pickle.load(f)
-        f.close()
-        logger.info('Column dictionary loaded, start encoding design layout...')
+        if self.artifact_cache is not None:
+            encoding = self.cached_stage('encoding', {'omp': self.stage_keys['omp'], 'nComponents': self.n_components,
+                                                      'code': code_version('preprocess', 'omp', 'strips')},
+                                         lambda: self.encode_strips(column_dict))
+        else:
+            encoding = self.encode_strips(column_dict)
 
-        encoding = ''
-        for file in tqdm(self.files, desc='Encoding strips'):
-            strip_image = np.array(Image.open(file, mode='r').convert('L'), dtype='uint8')
-            if self.node_tech == 32:
-                strip_image[0:5, :] = 0
-                strip_image[-5:, :] = 0
-            encoding += encode_image(strip_image, column_dict)
-            encoding += '\t'
-        logger.info('Encoding design layout completed.')
-
-        with open(os.path.join(self.encodingDir, 'image_encodings',
-                               f'{self.design}_{self.node_tech}nm_image_encoding_{self.n_components}.pkl'),
-                  'wb') as f:
-            pickle.dump(encoding, f)
-        f.close()
-        logger.info('Layout encoding saved.')
-        encoding_time = time.time()
+        encoding_file = os.path.join(*[self.encodingDir, 'image_encodings',
+                                       f'{self.design}_{self.node_tech}nm_image_encoding_{self.n_components}.pkl'])
+        self.save_artifact(encoding, encoding_file, save_encoding)
+        logger.info(f'Layout encoding saved, {time.time() - self.start_time: .1f}s after start.')
 
         return encoding
 
-    def pattern_search(self):
-        encoding_file = os.path.join(*[self.encodingDir, 'image_encodings',
-                                       f'{self.design}_{self.node_tech}nm_image_encoding_{self.n_components}.pkl'])
-        if os.path.exists(encoding_file):
-            with open(encoding_file, 'rb') as f:
-                image_encodings = pickle.load(f)
-            f.close()
-            logger.info('Layout encoding file found and loaded for GA pattern searching')
-        else:
-            logger.info('Layout encoding file not found, encoding layout image...')
-            image_encodings = self.encoding_layout()
+    def encode_strips(self, column_dict):
+        logger.info('Column dictionary loaded, start encoding design layout...')
 
+        with self.metrics.stage('encoding') as record:
+            if self.workers > 1:
+                # every worker builds its own read-only column index once, results come back in file order
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=init_encoding_worker,
+                                         initargs=(column_dict,)) as pool:
+                    results = list(tqdm(pool.map(encode_strip, self.files, [self.node_tech] * len(self.files)),
+                                        total=len(self.files), desc='Encoding strips'))
+            else:
+                init_encoding_worker(column_dict)
+                results = [encode_strip(file, self.node_tech) for file in tqdm(self.files, desc='Encoding strips')]
+
+            encoding = ''.join(strip_encoding + '\t' for strip_encoding, _ in results)
+            misses = sum(strip_misses for _, strip_misses in results)
+            record.update({'strips': len(self.files), 'dictionarySize': len(column_dict),
+                           'dictionaryMisses': misses, 'encodingLength': len(encoding)})
+        logger.info(f'Encoding design layout completed, {misses} columns matched by nearest neighbour.')
+        return encoding
+
+    def sweep_encodings(self):
+        # strips are read and their columns matched against the dictionary once, the encoding of every size of the
+        # sweep is then derived from the nearest ranks of the distinct columns
+        selection = self.column_selection()
+        self.n_components, sweep_dict = selection['n_components'], selection['sweep_dict']
+        sizes = [n for n in self.sweep_components if n <= len(sweep_dict)]
+        if len(sizes) < len(self.sweep_components):
+            logger.info(f'Sweep sizes above the {len(sweep_dict)} ranked columns are skipped.')
+
+        with self.metrics.stage('sweep') as record:
+            if self.workers > 1:
+                with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                    results = list(tqdm(pool.map(strip_columns, self.files, [self.node_tech] * len(self.files)),
+                                        total=len(self.files), desc='Reading strip columns'))
+            else:
+                results = [strip_columns(file, self.node_tech)
+                           for file in tqdm(self.files, desc='Reading strip columns')]
+            packed = np.concatenate([columns for columns, _ in results])
+            _, first, inverse = np.unique(column_keys(packed), return_index=True, return_inverse=True)
+            strips = np.split(inverse.ravel(), np.cumsum([len(columns) for columns, _ in results])[:-1])
+            sweep = ColumnSweep(sweep_dict, packed[first], results[0][1])
+
+            for n in sizes:
+                encoding_file = os.path.join(*[self.encodingDir, 'image_encodings',
+                                               f'{self.design}_{self.node_tech}nm_image_encoding_{n}.pkl'])
+                self.save_artifact(sweep.encode(strips, n), encoding_file, save_encoding)
+            record.update({'strips': len(self.files), 'columns': len(packed), 'distinctColumns': len(first),
+                           'sizes': sizes})
+        logger.info(f'Layout encodings of {len(sizes)} dictionary sizes saved, OMP selects {self.n_components}.')
+
+        metrics_file = os.path.join(*[self.resultDir, f'{self.design}_{self.node_tech}nm_metrics_sweep'
+                                                      f'.{self.metrics_format}'])
+        self.metrics.save(metrics_file)
+        return sizes
+
+    def serial_search(self, image_encodings, deadline=None):
         encodings = image_encodings.split('\t')[:-1]
+        # substrings recur across generations and strips, their layout counts are shared through one cache
+        cache = LRUCache(self.cache_size)
+        layout_index = OccurrenceIndex(image_encodings, cache=cache, name='layout')
 
         cells = []
-        for i in range(0, len(encodings)):
+        start, state = 0, None
+        checkpoint_file = self.checkpoint_file() if self.checkpoint_interval else None
+        checkpoint = load_checkpoint(checkpoint_file, 'serial', len(encodings), self.ga_settings)
+        if checkpoint is not None:
+            start, state, cells = checkpoint['strip'], checkpoint['state'], checkpoint['cells']
+            random.setstate(checkpoint['random'])
+            logger.info(f"Resuming GA search from checkpoint at encoding # {start}, iteration {state['epoch']}.")
+
+        for i in range(start, len(encodings)):
             logger.info(f"Searching on encoding # {i}...")
             encoding = encodings[i]
+            hits, misses = cache.hits, cache.misses
+
+            with self.metrics.stage('ga_strip', strip=i) as record:
+                encoding_index = OccurrenceIndex(encoding, cache=cache, name=i)
+                engine = span_engine(encoding, encoding_index, self.ga_settings)
+                if state is None or state['strip'] != i:
+                    state = init_search(i, encoding, self.ga_settings, cells, engine, f'{self.seed}:{i}')
+                while not finished(state, self.ga_settings, deadline):
+                    state = evolve(state, encoding, image_encodings, layout_index, encoding_index, self.ga_settings,
+                                   self.checkpoint_interval or np.inf, engine, deadline)
+                    if checkpoint_file is not None:
+                        save_checkpoint({'mode': 'serial', 'n_strips': len(encodings), 'settings': self.ga_settings,
+                                         'strip': i, 'state': state, 'cells': cells, 'random': random.getstate()},
+                                        checkpoint_file)
+                record.update(self.strip_metrics(state, len(encoding)))
+                record.update({'cacheHits': cache.hits - hits, 'cacheMisses': cache.misses - misses})
+            logger.info(f"Search on encoding # {i} stopped at iteration {state['epoch']}: {state['stopReason']}.")
+            best_population = state['best_population']
+            stats = cache.stats()
+            logger.info(f"Memo cache: {stats['hits']} hits, {stats['misses']} misses "
+                        f"({stats['hitRate'] * 100: .1f}% hit rate), {stats['size']} entries.")
+
+        unique_words = strip_cells(best_population, encoding, encoding_index)
+        return list(set(unique_words + cells))
+
+    def checkpoint_file(self):
+        return os.path.join(*[self.resultDir,
+                              f'{self.design}_{self.node_tech}nm_ga_checkpoint_{self.n_components}.pkl'])
+
+    def strip_metrics(self, state, length):
+        return {'length': length, 'generations': state['epoch'],
+                'coverage': state['evals'][-1] if len(state['evals']) > 1 else None,
+                'stopReason': state.get('stopReason'), 'searchSeconds': state.get('searchSeconds', 0),
+                'trace': state.get('trace', [])}
+
+    def search(self, image_encodings):
+        # the time budget is shared by all strips, it restarts when an interrupted search resumes
+        deadline = time.time() + self.time_budget if self.time_budget else None
+        with self.metrics.stage('ga') as record:
+            if self.ga_workers > 1:
+                logger.info(f'Searching all encodings in parallel on {self.ga_workers} workers...')
+                cells, states = island_search(image_encodings, self.ga_settings, self.ga_workers,
+                                              self.migration_interval, seed=self.seed, cache_size=self.cache_size,
+                                              checkpoint_file=self.checkpoint_file(),
+                                              checkpoint_interval=self.checkpoint_interval, deadline=deadline)
+                # islands are timed in their workers, summed over the migration rounds
+                for i, (state, encoding) in enumerate(zip(states, image_encodings.split('\t')[:-1])):
+                    logger.info(f"Island # {i} stopped at iteration {state['epoch']}: {state['stopReason']}.")
+                    self.metrics.add({'stage': 'ga_strip', 'strip': i, 'seconds': state.get('seconds'),
+                                      'cpuSeconds': state.get('cpuSeconds'), **self.strip_metrics(state, len(encoding)),
+                                      'cacheHits': state.get('totalCacheHits'),
+                                      'cacheMisses': state.get('totalCacheMisses')})
+            else:
+                cells = self.serial_search(image_encodings, deadline)
+            record.update({'strips': image_encodings.count('\t'), 'workers': self.ga_workers, 'cells': len(cells)})
+        return cells
 
-            population = generate_population(self.population_size, encoding, self.size_bounds, cells)
-            best_population = population
-            evals = [-np.inf]
-            epoch = 0
-
-            while evals[-1] <= self.threshold and epoch <= self.max_iter:
-                frequencies = count_frequency(population, image_encodings)
-                filtered_pop, filtered_freq = filter_by_freq(population, frequencies)
-
-                information_coverage, updated_encoding = fitness(encoding, population, frequencies)
-
-                if information_coverage > evals[-1]:
-                    evals.append(information_coverage)
-                    text_residual = updated_encoding
-
-                    logger.info(f"Improved information coverage: {information_coverage: 04f} at iteration {epoch}")
-                    best_population = population
-
-                population = nextPopulation(self.population_size, best_population, self.size_bounds, encoding)
-                epoch += 1
-
-        unique_words = remove_substrings(find_non_overlapping_strings(best_population,
-                                         count_frequency(best_population, encoding)))
-
-        cells = list(set(unique_words + cells))
+    def pattern_search(self):
+        encoding_file = os.path.join(*[self.encodingDir, 'image_encodings',
+                                       f'{self.design}_{self.node_tech}nm_image_encoding_{self.n_components}.pkl'])
+        if self.artifact_cache is not None:
+            if self.n_components and self.find_artifact(encoding_file):
+                # the encoding of an explicit size, e.g. written by a sweep, is searched as it is
+                image_encodings = load_encoding(self.find_artifact(encoding_file)).to_string()
+                self.stage_keys['encoding'] = file_digest(self.find_artifact(encoding_file))
+                logger.info('Layout encoding file found and loaded for GA pattern searching')
+            else:
+                image_encodings = self.encoding_layout()
+            # serial legacy search draws from the global random state, islands and the span engine are seeded;
+            # the engine and, for the span engine, the seed are part of the settings
+            islands = {'migrationInterval': self.migration_interval, 'seed': self.seed} if self.ga_workers > 1 else None
+            cells = self.cached_stage('ga', {'encoding': self.stage_keys['encoding'], 'settings': self.ga_settings,
+                                             'islands': islands,
+                                             'code': code_version('preprocess', 'ga', 'population', 'utils',
+                                                                  'text_index', 'token_encoding', 'substring_index')},
+                                      lambda: self.search(image_encodings))
+        else:
+            if self.find_artifact(encoding_file):
+                image_encodings = load_encoding(self.find_artifact(encoding_file)).to_string()
+                logger.info('Layout encoding file found and loaded for GA pattern searching')
+            else:
+                logger.info('Layout encoding file not found, encoding layout image...')
+                image_encodings = self.encoding_layout()
+            cells = self.search(image_encodings)
 
         file = os.path.join(*[self.resultDir, f'{self.design}_{self.node_tech}nm_final_cells_{self.n_components}.pkl'])
-        with open(file, 'wb') as f:
-            pickle.dump(cells, f)
-        f.close()
+        self.save_artifact(cells, file, write_strings)
+        if os.path.exists(self.checkpoint_file()):
+            os.remove(self.checkpoint_file())
 
         logger.info('GA searching results saved.')
         return image_encodings, cells
@@ -177,26 +408,44 @@ class Processor:
         encoding_file = os.path.join(*[self.encodingDir, 'image_encodings',
                                        f'{self.design}_{self.node_tech}nm_image_encoding_{self.n_components}.pkl'])
         cell_file = os.path.join(*[self.resultDir, f'{self.design}_{self.node_tech}nm_final_cells_{self.n_components}.pkl'])
-        if os.path.exists(cell_file):
+        if self.artifact_cache is None and self.find_artifact(cell_file):
             logger.info('Loading GA searching results for post-processing...')
-            with open(cell_file, 'rb') as f:
-                cells = pickle.load(f)
-            f.close()
-            with open(encoding_file, 'rb') as f:
-                image_encodings = pickle.load(f)
-            f.close()
+            cells = read_strings(self.find_artifact(cell_file))
+            image_encodings = load_encoding(self.find_artifact(encoding_file)).to_string()
         else:
             image_encodings, cells = self.pattern_search()
         logger.info('Loaded.')
         logger.info('Start post-processing...')
-        nodes = get_nodes(image_encodings, cells)
-        potential_nodes = merge_nodes(image_encodings, nodes)
+        if self.artifact_cache is not None:
+            potential_nodes = self.cached_stage('post', {'ga': self.stage_keys['ga'],
+                                                         'code': code_version('preprocess', 'graph_utils', 'utils',
+                                                                              'text_index', 'substring_index')},
+                                                lambda: self.extract_nodes(image_encodings, cells))
+        else:
+            potential_nodes = self.extract_nodes(image_encodings, cells)
 
         final_result = os.path.join(*[self.resultDir, f'{self.design}_{self.node_tech}nm_final_results_{self.n_components}.pkl'])
         logger.info('Saving final results...')
 
-        with open(final_result, "wb") as f:
-            pickle.dump(potential_nodes, f)
-        f.close()
+        self.save_artifact(potential_nodes, final_result, write_strings)
         logger.info('Post-processing Completed and final_results saved.')
+        if self.artifact_cache is not None:
+            self.artifact_cache.report()
+
+        metrics_file = os.path.join(*[self.resultDir, f'{self.design}_{self.node_tech}nm_metrics_{self.n_components}'
+                                                      f'.{self.metrics_format}'])
+        self.metrics.save(metrics_file)
+        logger.info(f'Pipeline completed in {time.time() - self.start_time: .1f}s, stage metrics saved to '
+                    f'{metrics_file}.')
+
+    def extract_nodes(self, image_encodings, cells):
+        with self.metrics.stage('nodes') as record:
+            nodes = get_nodes(image_encodings, cells)
+            record.update({'cells': len(cells), 'nodes': len(nodes)})
+        with self.metrics.stage('merge') as record:
+            # merge_nodes appends to nodes, so they are counted before it runs
+            record['nodes'] = len(nodes)
+            potential_nodes = merge_nodes(image_encodings, nodes)
+            record['potentialNodes'] = len(potential_nodes)
+        return potential_nodes
 
@@ -0,0 +1,155 @@
+import os
+import sys
+import csv
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from io import StringIO
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on windows, peak rss is then not reported
+    resource = None
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PROFILED_STAGES = ['extraction', 'omp', 'encoding', 'ga', 'nodes', 'merge']
+
+
+def peak_rss(who='self'):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # kilobytes on linux, bytes on macos
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    # linux resets the peak rss of the process when 5 is written to clear_refs, elsewhere the peak of a stage is
+    # the peak of the process up to its end
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        f.close()
+        return True
+    except OSError:
+        return False
+
+
+class StackSampler:
+    # samples the stack of the calling thread every interval seconds, dumped as collapsed stacks that flame
+    # graph tools read
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self.thread_id = threading.get_ident()
+        self.running = False
+        self.thread = None
+
+    def sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def enable(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def disable(self):
+        self.running = False
+        self.thread.join()
+
+    def dump(self, file):
+        with open(file, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f'{stack} {count}\n')
+        f.close()
+
+    def summary(self, lines=15):
+        functions = Counter()
+        for stack, count in self.counts.items():
+            functions[stack.rsplit(';', 1)[-1]] += count
+        total = sum(functions.values()) or 1
+        return '\n'.join(f'{count / total * 100: 6.1f}% {function}' for function, count in functions.most_common(lines))
+
+
+class StageMetrics:
+    # one record per stage run with wall and cpu time, peak rss and whatever counts the stage adds to it;
+    # selected stages are profiled in this process, worker processes are not
+    def __init__(self, profile_stages=(), profiler='cprofile', profile_dir='.'):
+        self.records = []
+        self.profile_stages = set(profile_stages)
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.depth = 0
+
+    @contextmanager
+    def stage(self, name, **fields):
+        record = {'stage': name, **fields}
+        # nested stages do not reset the peak of the stage around them
+        scope = 'stage' if self.depth == 0 and reset_peak_rss() else 'process'
+        profiler = None
+        if name in self.profile_stages:
+            profiler = cProfile.Profile() if self.profiler == 'cprofile' else StackSampler()
+            profiler.enable()
+        self.depth += 1
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - wall
+            record['cpuSeconds'] = time.process_time() - cpu
+            self.depth -= 1
+            if profiler is not None:
+                profiler.disable()
+                self.save_profile(profiler, '_'.join([name] + [str(value) for value in fields.values()]))
+            record['peakRss'] = peak_rss()
+            record['peakRssScope'] = scope
+            record['peakRssChildren'] = peak_rss('children')
+            self.records.append(record)
+
+    def add(self, record):
+        self.records.append(record)
+
+    def save_profile(self, profiler, name):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if self.profiler == 'cprofile':
+            file = os.path.join(self.profile_dir, f'{name}.prof')
+            profiler.dump_stats(file)
+            summary = StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+            summary = summary.getvalue()
+        else:
+            file = os.path.join(self.profile_dir, f'{name}.stacks')
+            profiler.dump(file)
+            summary = profiler.summary()
+        logger.info(f'Profile of {name} saved to {file}:\n{summary}')
+
+    def save(self, file):
+        if file.endswith('.csv'):
+            # lists such as convergence traces are written as json inside their cell
+            columns = list(dict.fromkeys(key for record in self.records for key in record))
+            with open(file, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=columns)
+                writer.writeheader()
+                for record in self.records:
+                    writer.writerow({key: json.dumps(value) if isinstance(value, (list, dict)) else value
+                                     for key, value in record.items()})
+            f.close()
+        else:
+            with open(file, 'w') as f:
+                json.dump(self.records, f, indent=2)
+            f.close()
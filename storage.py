@@ -0,0 +1,142 @@
+import os
+import json
+import zlib
+import pickle
+import numpy as np
+
+# file layout: MAGIC, uint32 version, uint32 header size, a json header naming every array with its dtype,
+# shape and offset, then the arrays themselves, each aligned so that uncompressed ones can be memory-mapped
+MAGIC = b'GACELLS\0'
+VERSION = 1
+ALIGNMENT = 64
+
+
+def binary_file(filename):
+    return os.path.splitext(filename)[0] + '.bin'
+
+
+def is_binary(filename):
+    with open(filename, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    f.close()
+    return magic == MAGIC
+
+
+def write_arrays(filename, kind, arrays, meta=None, compress=False):
+    header = {'kind': kind, 'meta': meta or {}, 'arrays': {}}
+    blobs = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        blob = zlib.compress(array.tobytes()) if compress else array.tobytes()
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset,
+                                  'size': len(blob), 'compressed': compress}
+        blobs.append(blob)
+        offset += -(-len(blob) // ALIGNMENT) * ALIGNMENT
+
+    encoded = json.dumps(header).encode()
+    start = -(-(len(MAGIC) + 8 + len(encoded)) // ALIGNMENT) * ALIGNMENT
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(MAGIC + np.array([VERSION, len(encoded)], dtype='<u4').tobytes() + encoded)
+        for name, blob in zip(header['arrays'], blobs):
+            f.seek(start + header['arrays'][name]['offset'])
+            f.write(blob)
+    f.close()
+    os.replace(filename + '.tmp', filename)
+
+
+class StoredArrays:
+    # arrays are read only when first accessed, uncompressed ones as read-only memory maps
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{filename} is not a binary artifact')
+            version, size = np.frombuffer(f.read(8), dtype='<u4')
+            if version > VERSION:
+                raise ValueError(f'{filename} was written by a newer format version {version}')
+            header = json.loads(f.read(int(size)))
+        f.close()
+        self.kind = header['kind']
+        self.meta = header['meta']
+        self.arrays = header['arrays']
+        self.start = -(-(len(MAGIC) + 8 + int(size)) // ALIGNMENT) * ALIGNMENT
+        self.loaded = {}
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            spec = self.arrays[name]
+            dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+            if spec['compressed']:
+                with open(self.filename, 'rb') as f:
+                    f.seek(self.start + spec['offset'])
+                    blob = zlib.decompress(f.read(spec['size']))
+                f.close()
+                self.loaded[name] = np.frombuffer(blob, dtype=dtype).reshape(shape)
+            elif int(np.prod(shape)) == 0:
+                self.loaded[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self.loaded[name] = np.memmap(self.filename, dtype=dtype, mode='r',
+                                              offset=self.start + spec['offset'], shape=shape)
+        return self.loaded[name]
+
+
+def read_arrays(filename, kind=None):
+    stored = StoredArrays(filename)
+    if kind is not None and stored.kind != kind:
+        raise ValueError(f'{filename} holds {stored.kind}, not {kind}')
+    return stored
+
+
+def write_column_dict(column_dict, filename, compress=False):
+    # columns hold 0 or a single fill value, so they are stored as a bit matrix next to their codes
+    columns = np.array(list(column_dict.keys()))
+    codes = np.array(list(column_dict.values()), dtype='S')
+    fill = int(columns.max()) if columns.size else 0
+    if np.all((columns == 0) | (columns == fill)):
+        height = columns.shape[1] if columns.ndim == 2 else 0
+        write_arrays(filename, 'column_dict', {'bits': np.packbits(columns != 0, axis=1), 'codes': codes},
+                     {'height': height, 'fill': fill, 'dtype': columns.dtype.str}, compress)
+    else:
+        write_arrays(filename, 'column_dict', {'columns': columns, 'codes': codes}, {}, compress)
+
+
+def read_column_dict(filename):
+    # binary column dictionaries, or the pickled dicts of earlier runs
+    if not is_binary(filename):
+        with open(filename, 'rb') as f:
+            column_dict = pickle.load(f)
+        f.close()
+        return column_dict
+    stored = read_arrays(filename, 'column_dict')
+    if 'columns' in stored:
+        columns = np.asarray(stored['columns'])
+    else:
+        meta = stored.meta
+        bits = np.unpackbits(stored['bits'], axis=1, count=meta['height'])
+        columns = bits.astype(np.dtype(meta['dtype'])) * meta['fill']
+    codes = [code.decode('ascii') for code in stored['codes'].tolist()]
+    return dict(zip(map(tuple, columns.tolist()), codes))
+
+
+def write_strings(strings, filename, compress=False):
+    data = [string.encode('utf-8') for string in strings]
+    offsets = np.cumsum([0] + [len(string) for string in data])
+    offsets = offsets.astype(np.uint32 if offsets[-1] < 2 ** 32 else np.uint64)
+    write_arrays(filename, 'strings', {'data': np.frombuffer(b''.join(data), dtype=np.uint8), 'offsets': offsets},
+                 {}, compress)
+
+
+def read_strings(filename):
+    # binary string lists such as GA cells and final results, or their pickles from earlier runs
+    if not is_binary(filename):
+        with open(filename, 'rb') as f:
+            strings = pickle.load(f)
+        f.close()
+        return strings
+    stored = read_arrays(filename, 'strings')
+    data, offsets = bytes(stored['data']), stored['offsets'].tolist()
+    return [data[start:stop].decode('utf-8') for start, stop in zip(offsets[:-1], offsets[1:])]
@@ -0,0 +1,234 @@
+import os
+import pickle
+import struct
+import logging
+import numpy as np
+from PIL import Image
+from numpy.lib.format import open_memmap
+from omp import pack_columns
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def load_strip(file, node_tech):
+    strip_image = np.array(Image.open(file, mode='r').convert('L'), dtype='uint8')
+    if node_tech == 32:  # removing vcc lines in 32nm
+        strip_image[0:5, :] = 0
+        strip_image[-5:, :] = 0
+    return strip_image
+
+
+class StripReader:
+    def __init__(self, files, node_tech, cache_file=None):
+        self.files = files
+        self.node_tech = node_tech
+        self.cache_file = cache_file
+        # only image headers are read here, pixel data is loaded one strip at a time
+        sizes = [Image.open(file).size for file in files]
+        self.widths = [size[0] for size in sizes]
+        self.height = sizes[0][1] if sizes else 0
+        self.fill = 0
+
+    def __iter__(self):
+        for file in self.files:
+            yield load_strip(file, self.node_tech)
+
+    def signature(self):
+        return {'files': [os.path.abspath(file) for file in self.files],
+                'mtimes': [os.path.getmtime(file) for file in self.files],
+                'widths': self.widths,
+                'height': self.height,
+                'node_tech': self.node_tech}
+
+    def load_cache(self):
+        meta_file = os.path.splitext(self.cache_file)[0] + '.pkl'
+        if not os.path.exists(self.cache_file) or not os.path.exists(meta_file):
+            return None
+        with open(meta_file, 'rb') as f:
+            meta = pickle.load(f)
+        f.close()
+        if meta['signature'] != self.signature():
+            return None
+        self.fill = meta['fill']
+        return np.load(self.cache_file, mmap_mode='r')
+
+    def packed_columns(self):
+        # yields the bit-packed columns of every strip, from the memory-mapped cache when it is up to date
+        cached = self.load_cache() if self.cache_file else None
+        if cached is not None:
+            offsets = np.cumsum([0] + self.widths)
+            for start, stop in zip(offsets[:-1], offsets[1:]):
+                yield cached[start:stop]
+            return
+
+        cache = None
+        if self.cache_file:
+            cache = open_memmap(self.cache_file, mode='w+', dtype=np.uint64,
+                                shape=(sum(self.widths), (self.height + 63) // 64))
+        start = 0
+        for strip_image in self:
+            self.fill = max(self.fill, int(strip_image.max()))
+            packed = pack_columns(strip_image)
+            if cache is not None:
+                cache[start:start + packed.shape[0]] = packed
+            start += packed.shape[0]
+            yield packed
+
+        if cache is not None:
+            cache.flush()
+            with open(os.path.splitext(self.cache_file)[0] + '.pkl', 'wb') as f:
+                pickle.dump({'signature': self.signature(), 'fill': self.fill}, f)
+            f.close()
+
+
+def gray(red, green, blue):
+    # ITU-R 601-2 luma, the conversion of PIL's convert('L')
+    return ((red.astype(np.uint32) * 19595 + green.astype(np.uint32) * 38470 + blue.astype(np.uint32) * 7471
+             + 0x8000) >> 16).astype(np.uint8)
+
+
+class LayoutImage:
+    # grayscale rows of a full layout image, read from the file one band at a time. Uncompressed BMPs are read
+    # as they are, other formats are decoded once by PIL into a raw grayscale .npy cache that is read instead
+    def __init__(self, file, cache_file=None):
+        self.file = file
+        self.palette = None
+        if not self.read_bmp_header():
+            self.source = self.load_cache(cache_file or os.path.splitext(file)[0] + '_gray.npy')
+
+    def read_bmp_header(self):
+        with open(self.file, 'rb') as f:
+            header = f.read(54)
+            if len(header) < 54 or header[:2] != b'BM':
+                f.close()
+                return False
+            offset, dib_size, width, height, _, bits, compression = struct.unpack_from('<IIiiHHI', header, 10)
+            # only uncompressed rows of 1, 8, 24 or 32 bits per pixel (bitfields of 32 bit BGRA included)
+            if bits not in (1, 8, 24, 32) or compression not in (0, 3) or (compression == 3 and bits != 32):
+                f.close()
+                return False
+            if bits <= 8:
+                f.seek(14 + dib_size)
+                entries = np.frombuffer(f.read(4 * (1 << bits)), dtype=np.uint8).reshape(-1, 4)
+                self.palette = gray(entries[:, 2], entries[:, 1], entries[:, 0])
+        f.close()
+        self.source, self.offset, self.stride = self.file, offset, (bits * width + 31) // 32 * 4
+        self.width, self.height, self.bits, self.bottom_up = width, abs(height), bits, height > 0
+        return True
+
+    def load_cache(self, cache_file):
+        if not os.path.exists(cache_file) or os.path.getmtime(cache_file) < os.path.getmtime(self.file):
+            logger.info(f'{os.path.basename(self.file)} is not an uncompressed BMP, decoding it once into '
+                        f'{cache_file}...')
+            with Image.open(self.file) as image:
+                gray_image = np.asarray(image.convert('L'))
+            np.save(cache_file + '.tmp.npy', gray_image)
+            del gray_image
+            os.replace(cache_file + '.tmp.npy', cache_file)
+        with open(cache_file, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else \
+                np.lib.format.read_array_header_2_0
+            shape, _, _ = read_header(f)
+            self.offset = f.tell()
+        f.close()
+        self.height, self.width = shape
+        self.stride, self.bits, self.bottom_up = self.width, 8, False
+        return cache_file
+
+    def rows(self, start, stop):
+        # rows start to stop counted from the top of the layout
+        first = self.height - stop if self.bottom_up else start
+        with open(self.source, 'rb') as f:
+            f.seek(self.offset + first * self.stride)
+            rows = np.frombuffer(f.read((stop - start) * self.stride), dtype=np.uint8).reshape(-1, self.stride)
+        f.close()
+        if self.bottom_up:
+            rows = rows[::-1]
+        if self.bits == 1:
+            return self.palette[np.unpackbits(rows, axis=1)[:, :self.width]]
+        if self.bits == 8:
+            return self.palette[rows[:, :self.width]] if self.palette is not None else rows[:, :self.width]
+        pixels = rows[:, :self.width * self.bits // 8].reshape(rows.shape[0], self.width, self.bits // 8)
+        return gray(pixels[:, :, 2], pixels[:, :, 1], pixels[:, :, 0])
+
+    def bands(self, band_bytes=16 * 2 ** 20):
+        # sized by the bytes of a decoded grayscale row or of a raw row, whichever is larger
+        band = max(1, band_bytes // max(self.width, self.stride))
+        for start in range(0, self.height, band):
+            yield start, self.rows(start, min(start + band, self.height))
+
+
+def row_density(layout, threshold=128, band_bytes=16 * 2 ** 20):
+    # foreground pixels of every layout row, read one band of rows at a time
+    density = np.zeros(layout.height, dtype=np.int64)
+    for start, rows in layout.bands(band_bytes):
+        density[start:start + rows.shape[0]] = np.count_nonzero(rows > threshold, axis=1)
+    return density
+
+
+def density_runs(density, minimum):
+    rows = np.flatnonzero(density >= minimum)
+    if rows.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) > 1)
+    return list(zip(rows[np.r_[0, breaks + 1]].tolist(), rows[np.r_[breaks, rows.size - 1]].tolist()))
+
+
+def grow_rail(density, first, last, edge=0.25):
+    # anti-aliased edge rows of a rail belong to it as long as they are denser than edge times its core
+    core = density[first:last + 1].max()
+    while first > 0 and density[first - 1] >= edge * core:
+        first -= 1
+    while last < density.size - 1 and density[last + 1] >= edge * core:
+        last += 1
+    return first, last
+
+
+def find_rails(density, strong=0.6, weak=0.25, tolerance=3):
+    # VCC and VSS rails are the densest rows of the layout, a contact on every track. Rails at the edges of a
+    # design can be sparser, they are accepted at a weaker density where the rail pitch predicts them
+    rails = density_runs(density, strong * density.max()) if density.size and density.max() > 0 else []
+    rails = [grow_rail(density, first, last) for first, last in rails]
+    if len(rails) < 2:
+        return rails
+    pitch = int(np.median(np.diff([last for _, last in rails])))
+    weak_rails = density_runs(density, weak * density.max())
+    for step in (-1, 1):
+        while True:
+            expected = (rails[0] if step < 0 else rails[-1])[1] + step * pitch
+            found = [grow_rail(density, *run) for run in weak_rails if abs(run[1] - expected) <= tolerance]
+            if not found:
+                break
+            rails = [found[0]] + rails if step < 0 else rails + [found[0]]
+    return rails
+
+
+def segment_layout(file, strip_dir, strip_height=0, threshold=128, clear_rails=False, cache_file=None,
+                   band_bytes=16 * 2 ** 20):
+    # cuts a full layout into one strip per standard-cell row. A strip starts on the lowest two rows of the rail
+    # above its row and is as high as the most common rail pitch, which reproduces the des 32nm strips; strips
+    # are numbered from the bottom of the layout and only one strip is in memory at a time
+    layout = LayoutImage(file, cache_file)
+    density = row_density(layout, threshold, band_bytes)
+    rails = find_rails(density)
+    if len(rails) < 2:
+        raise ValueError(f'No standard-cell rows found in {file}, {len(rails)} rails detected.')
+    lasts = np.array([last for _, last in rails])
+    pitches, frequency = np.unique(np.diff(lasts), return_counts=True)
+    strip_height = strip_height or int(pitches[np.argmax(frequency)])
+    starts = [last - 1 for last in lasts.tolist() if last - 1 + strip_height <= layout.height]
+    logger.info(f'{len(rails)} rails detected in {os.path.basename(file)}, cutting {len(starts)} strips of '
+                f'{strip_height} rows.')
+
+    os.makedirs(strip_dir, exist_ok=True)
+    files = []
+    for i, start in enumerate(reversed(starts)):
+        strip = np.where(layout.rows(start, start + strip_height) > threshold, 255, 0).astype(np.uint8)
+        if clear_rails:
+            for first, last in rails:
+                strip[max(first - start, 0):max(last + 1 - start, 0)] = 0
+        files.append(os.path.join(strip_dir, f'{i:03d}.bmp'))
+        Image.fromarray(strip, mode='L').save(files[-1])
+    return files
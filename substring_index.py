@@ -0,0 +1,174 @@
+from bisect import bisect_left, bisect_right
+from text_index import TOKEN_TEXT
+
+
+class SubstringIndex:
+    # containment and overlap relations within a growing set of candidate strings. Containment is answered by a
+    # generalized suffix automaton where every state keeps the length of the longest candidate containing it,
+    # overlaps by maps from candidate prefixes and aligned suffixes. Both are built on first use. When every
+    # candidate is made of encoding codes the automaton runs over codes, a code can only match at a code boundary.
+    def __init__(self, strings=(), bits=3):
+        self.bits = bits
+        self.strings = []
+        self.next = None
+        self.tour = None
+        self.prefixes = None
+        self.suffixes = None
+        for string in strings:
+            self.add(string)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def add(self, string):
+        self.strings.append(string)
+        if self.next is not None and self.aligned and not self.is_aligned(string):
+            self.build()
+        elif self.next is not None:
+            self.insert(len(self.strings) - 1)
+            self.tour = None
+        if self.prefixes is not None:
+            self.insert_overlaps(string)
+
+    def is_aligned(self, string):
+        return len(string) % self.bits == 0 and TOKEN_TEXT.fullmatch(string) is not None
+
+    def symbols(self, string):
+        if self.aligned:
+            return [string[i:i + self.bits] for i in range(0, len(string), self.bits)]
+        return string
+
+    def build(self):
+        self.next, self.link, self.length, self.longest = [{}], [-1], [0], [0]
+        self.prefix_states = []
+        self.tour = None
+        self.aligned = self.bits == 3 and all(self.is_aligned(string) for string in self.strings)
+        for i in range(len(self.strings)):
+            self.insert(i)
+
+    def insert(self, i):
+        string = self.strings[i]
+        states, last = [], 0
+        for char in self.symbols(string):
+            last = self.extend(last, char)
+            states.append(last)
+        self.prefix_states.append(states)
+        # the longest containing candidate only grows towards the root, so climbing stops at the first state
+        # that already knows a candidate at least as long
+        for state in states:
+            while state != -1 and self.longest[state] < len(string):
+                self.longest[state] = len(string)
+                state = self.link[state]
+
+    def extend(self, last, char):
+        nxt, link, length = self.next, self.link, self.length
+        if char in nxt[last]:
+            q = nxt[last][char]
+            if length[last] + 1 == length[q]:
+                return q
+            clone = self.clone(q, length[last] + 1)
+            p = last
+            while p != -1 and nxt[p].get(char) == q:
+                nxt[p][char] = clone
+                p = link[p]
+            return clone
+
+        cur = len(nxt)
+        nxt.append({})
+        link.append(0)
+        length.append(length[last] + 1)
+        self.longest.append(0)
+        p = last
+        while p != -1 and char not in nxt[p]:
+            nxt[p][char] = cur
+            p = link[p]
+        if p != -1:
+            q = nxt[p][char]
+            if length[p] + 1 == length[q]:
+                link[cur] = q
+            else:
+                clone = self.clone(q, length[p] + 1)
+                while p != -1 and nxt[p].get(char) == q:
+                    nxt[p][char] = clone
+                    p = link[p]
+                link[cur] = clone
+        return cur
+
+    def clone(self, q, size):
+        clone = len(self.next)
+        self.next.append(dict(self.next[q]))
+        self.link.append(self.link[q])
+        self.length.append(size)
+        self.longest.append(self.longest[q])
+        self.link[q] = clone
+        return clone
+
+    def state(self, string):
+        state = 0
+        for char in self.symbols(string):
+            state = self.next[state].get(char)
+            if state is None:
+                return None
+        return state
+
+    def supports(self, string):
+        if self.next is None:
+            self.build()
+        return not self.aligned or self.is_aligned(string)
+
+    def has_parent(self, string):
+        # whether a strictly longer candidate contains string
+        if not self.supports(string):
+            return any(string in candidate and len(candidate) > len(string) for candidate in self.strings)
+        state = self.state(string)
+        return state is not None and self.longest[state] > len(string)
+
+    def build_tour(self):
+        # euler tour of the suffix link tree: string is contained in a candidate iff one of the candidate's
+        # prefix states lies in the subtree of the state of string
+        children = [[] for _ in self.next]
+        for state in range(1, len(self.next)):
+            children[self.link[state]].append(state)
+        tin, tout = [0] * len(self.next), [0] * len(self.next)
+        clock, stack = 0, [(0, False)]
+        while stack:
+            state, done = stack.pop()
+            if done:
+                tout[state] = clock - 1
+                continue
+            tin[state] = clock
+            clock += 1
+            stack.append((state, True))
+            stack.extend((child, False) for child in children[state])
+        points = sorted((tin[state], i) for i, states in enumerate(self.prefix_states) for state in states)
+        self.tour = (tin, tout, [point for point, _ in points], [i for _, i in points])
+
+    def containing(self, string):
+        # sorted ids of the candidates that contain string, itself included
+        if not self.supports(string):
+            return [i for i, candidate in enumerate(self.strings) if string in candidate]
+        state = self.state(string)
+        if state is None:
+            return []
+        if self.tour is None:
+            self.build_tour()
+        tin, tout, points, ids = self.tour
+        return sorted(set(ids[bisect_left(points, tin[state]):bisect_right(points, tout[state])]))
+
+    def insert_overlaps(self, string):
+        for size in range(1, len(string) + 1):
+            self.prefixes[string[:size]] = max(self.prefixes.get(string[:size], 0), len(string))
+        for offset in range(0, len(string), self.bits):
+            self.suffixes[string[offset:]] = min(self.suffixes.get(string[offset:], offset), offset)
+
+    def overlaps(self, string):
+        # whether string and a candidate overlap at a bits-aligned offset of the one on the left, the check of
+        # utils.find_non_overlapping_strings
+        if self.prefixes is None:
+            self.prefixes, self.suffixes = {}, {}
+            for candidate in self.strings:
+                self.insert_overlaps(candidate)
+        for offset in range(0, len(string), self.bits):
+            if self.prefixes.get(string[offset:], 0) > offset:
+                return True
+        return any(self.suffixes.get(string[:size], len(string)) < len(string) for size in range(1, len(string) + 1))
@@ -0,0 +1,78 @@
+import os
+import numpy as np
+from PIL import Image
+
+# geometry of the des 32nm contact-layer strips: 167 px rows between 5 px VCC rails, 5 px contacts on a 15 px
+# track pitch, placed on a vertical grid of contact slots
+STRIP_HEIGHT = 167
+RAIL_HEIGHT = 5
+CONTACT_SIZE = 5
+TRACK_PITCH = 15
+SLOT_PITCH = 6
+
+
+def make_library(n_cells, rng, height=STRIP_HEIGHT, tracks=(2, 8), density=0.25):
+    # every cell is a list of tracks, each holding the filled contact slots and their offsets within the track
+    slots = (height - 2 * RAIL_HEIGHT - 2 * CONTACT_SIZE) // SLOT_PITCH
+    library = []
+    for _ in range(n_cells):
+        n_tracks = int(rng.integers(tracks[0], tracks[1] + 1))
+        cell = []
+        for _ in range(n_tracks):
+            filled = np.flatnonzero(rng.random(slots) < density)
+            cell.append((filled, rng.integers(0, TRACK_PITCH - CONTACT_SIZE, size=len(filled))))
+        library.append(cell)
+    return library
+
+
+def render_cell(cell, rng, height=STRIP_HEIGHT, noise=0.0):
+    # noise widens or shifts a contact by one pixel, like the 5 and 6 px contacts of the scanned strips
+    image = np.zeros((height, len(cell) * TRACK_PITCH), dtype=np.uint8)
+    top = RAIL_HEIGHT + CONTACT_SIZE
+    for track, (slots, offsets) in enumerate(cell):
+        for slot, offset in zip(slots.tolist(), offsets.tolist()):
+            x, y = track * TRACK_PITCH + offset, top + slot * SLOT_PITCH
+            width, dy = CONTACT_SIZE, 0
+            if noise and rng.random() < noise:
+                width += 1
+            if noise and rng.random() < noise:
+                dy = int(rng.choice([-1, 1]))
+            image[y + dy:y + dy + CONTACT_SIZE, x:x + width] = 255
+    return image
+
+
+def make_strip(width, library, rng, height=STRIP_HEIGHT, mirror=0.5, noise=0.0, filler=2):
+    # cells are drawn with zipf-like frequencies, a few of them make up most of a real design
+    weights = 1 / np.arange(1, len(library) + 1)
+    weights /= weights.sum()
+    strip = np.zeros((height, width), dtype=np.uint8)
+    # power rails are a row of contacts on every track
+    for x in range(0, width - CONTACT_SIZE, TRACK_PITCH):
+        x += (TRACK_PITCH - CONTACT_SIZE) // 2
+        strip[:RAIL_HEIGHT, x:x + CONTACT_SIZE] = 255
+        strip[-RAIL_HEIGHT:, x:x + CONTACT_SIZE] = 255
+    x = 0
+    while True:
+        x += int(rng.integers(0, filler + 1)) * TRACK_PITCH
+        cell = library[int(rng.choice(len(library), p=weights))]
+        if x + len(cell) * TRACK_PITCH > width:
+            break
+        image = render_cell(cell, rng, height, noise)
+        if rng.random() < mirror:
+            image = image[:, ::-1]
+        strip[:, x:x + image.shape[1]] |= image
+        x += image.shape[1]
+    return strip
+
+
+def generate_layout(data_root, design='synthetic', node_tech=32, n_strips=7, width=8819, n_cells=40, seed=0,
+                    mirror=0.5, noise=0.05):
+    # strips are written where Processor looks for them, data_root/strip_{design}_{node_tech}/
+    rng = np.random.default_rng(seed)
+    library = make_library(n_cells, rng)
+    strip_dir = os.path.join(*[data_root, f'strip_{design}_{node_tech}'])
+    os.makedirs(strip_dir, exist_ok=True)
+    for i in range(n_strips):
+        strip = make_strip(width, library, rng, mirror=mirror, noise=noise)
+        Image.fromarray(strip, mode='L').save(os.path.join(strip_dir, f'{i:03d}.bmp'))
+    return strip_dir
@@ -0,0 +1,49 @@
+import os
+import benchmark
+from preprocess import Processor
+from synthetic_layout import generate_layout
+from token_encoding import load_encoding
+
+
+def make_config(root, **settings):
+    config = benchmark.make_config(benchmark.parser.parse_args([]), str(root))
+    config.update(settings)
+    return config
+
+
+def searched_encodings(processor):
+    # the GA search is replaced by one that records the encoding it is given
+    searched = []
+
+    def search(image_encodings):
+        searched.append(image_encodings)
+        return []
+    processor.search = search
+    processor.pattern_search()
+    return searched
+
+
+def encoding_artifact(processor, n):
+    file = processor.find_artifact(os.path.join(processor.encodingDir, 'image_encodings',
+                                                f'{processor.design}_{processor.node_tech}nm_image_encoding_{n}.pkl'))
+    return load_encoding(file).to_string()
+
+
+def test_stage_cache_searches_explicit_n_components(tmp_path):
+    generate_layout(os.path.join(tmp_path, 'data'), n_strips=2, width=1500, n_cells=12, seed=1)
+    sweep = Processor(make_config(tmp_path, sweepComponents=[20, 40]))
+    sweep.sweep_encodings()
+
+    processor = Processor(make_config(tmp_path, n_components=20, stageCache=os.path.join(tmp_path, 'cache')))
+    assert searched_encodings(processor) == [encoding_artifact(sweep, 20)]
+    assert processor.n_components == 20
+    assert os.path.exists(os.path.join(processor.resultDir, 'synthetic_32nm_final_cells_20.bin'))
+
+    # without an encoding of that size, it is encoded from the prefix of the cached OMP ranking
+    swept = encoding_artifact(sweep, 40)
+    os.remove(processor.find_artifact(os.path.join(processor.encodingDir, 'image_encodings',
+                                                   'synthetic_32nm_image_encoding_40.pkl')))
+    processor = Processor(make_config(tmp_path, n_components=40, stageCache=os.path.join(tmp_path, 'cache')))
+    searched = searched_encodings(processor)
+    assert processor.n_components == 40
+    assert searched == [swept]
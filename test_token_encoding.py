@@ -0,0 +1,15 @@
+from token_encoding import TokenEncoding
+from utils import fitness
+
+
+def test_pattern_longer_than_encoding():
+    encoding = TokenEncoding.from_string('aa1bb2')
+    assert len(encoding.find('aa1bb2aa1bb2')) == 0
+    assert encoding.count('aa1bb2aa1bb2') == 0 == 'aa1bb2'.count('aa1bb2aa1bb2')
+    assert encoding.replace('aa1bb2aa1bb2', '\t').to_string() == 'aa1bb2'
+
+
+def test_fitness_on_short_strip():
+    text = 'aa1bb2'
+    population = ['aa1bb2aa1bb2', 'aa1']
+    assert fitness(TokenEncoding.from_string(text), population, [1, 1]) == fitness(text, population, [1, 1])
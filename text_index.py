@@ -0,0 +1,121 @@
+import re
+import random
+from bisect import bisect_left, bisect_right
+import numpy as np
+from token_encoding import TokenEncoding
+
+# layout encodings are sequences of 3-character codes from omp.encode_base62 separated by '\t'
+TOKEN_TEXT = re.compile('(?:[a-zA-Z]{2}[0-9])*')
+SEPARATOR = '~~~'
+
+
+def suffix_array(tokens):
+    # prefix doubling, O(n log^2 n) with numpy sorts
+    n = len(tokens)
+    rank = np.unique(tokens, return_inverse=True)[1].ravel().astype(np.int64)
+    suffixes = np.argsort(rank, kind='stable')
+    k = 1
+    while k < n:
+        second = np.full(n, -1, dtype=np.int64)
+        second[:n - k] = rank[k:]
+        suffixes = np.lexsort((second, rank))
+        changed = (rank[suffixes][1:] != rank[suffixes][:-1]) | (second[suffixes][1:] != second[suffixes][:-1])
+        rank = np.empty(n, dtype=np.int64)
+        rank[suffixes] = np.concatenate([[0], np.cumsum(changed)])
+        if rank[suffixes[-1]] == n - 1:
+            break
+        k *= 2
+    return suffixes
+
+
+def has_border(pattern, bits=3):
+    return any(pattern[k:] == pattern[:-k] for k in range(bits, len(pattern), bits))
+
+
+class OccurrenceIndex:
+    def __init__(self, text, bits=3, cache=None, name=None):
+        # text is a layout encoding string or a TokenEncoding of it, counts and positions are memoized in
+        # cache under name, so one LRUCache can be shared by the indexes of the layout and of every strip
+        self.cache = cache
+        self.name = name
+        encoding = text if isinstance(text, TokenEncoding) else None
+        self.text = text.to_string() if encoding is not None else text
+        self.bits = bits
+        pieces = self.text.split('\t')
+        self.valid = all(TOKEN_TEXT.fullmatch(piece) for piece in pieces)
+        if not self.valid:
+            return
+        if encoding is None:
+            encoding = TokenEncoding.from_string(self.text, bits)
+
+        # strips are joined by a separator id that sorts after every code of the vocabulary, so that
+        # ordering suffixes by token ids is the same as ordering their character slices
+        self.flat = SEPARATOR.join(pieces)
+        separator = len(encoding.vocabulary)
+        codes = np.insert(encoding.tokens.astype(np.int64), encoding.offsets[1:-1], separator)
+        self.suffixes = suffix_array(codes) if len(codes) else np.zeros(0, dtype=np.int64)
+
+        # character offset of every token in the original text, i.e. shifted back by the separators
+        separators = np.cumsum(codes == separator)
+        self.offsets = np.arange(len(codes)) * bits - separators * (bits - 1)
+
+    def supports(self, pattern):
+        return self.valid and isinstance(pattern, str) and len(pattern) > 0 and TOKEN_TEXT.fullmatch(pattern)
+
+    def interval(self, pattern):
+        size = len(pattern)
+        key = lambda i: self.flat[i * self.bits:i * self.bits + size]
+        return bisect_left(self.suffixes, pattern, key=key), bisect_right(self.suffixes, pattern, key=key)
+
+    def token_positions(self, pattern):
+        # unsorted token positions of every occurrence of a code-aligned pattern
+        if self.cache is not None:
+            return self.cache.get((pattern, self.name, 'positions'),
+                                  lambda: self.suffixes[slice(*self.interval(pattern))])
+        lo, hi = self.interval(pattern)
+        return self.suffixes[lo:hi]
+
+    def positions(self, pattern):
+        # sorted character positions of every (possibly overlapping) occurrence of pattern in text
+        if not self.supports(pattern):
+            return np.array([i for i in range(len(self.text)) if self.text.startswith(pattern, i)], dtype=np.int64)
+        lo, hi = self.interval(pattern)
+        return np.sort(self.offsets[self.suffixes[lo:hi]])
+
+    def sample(self, pattern, rng=random):
+        # a uniformly drawn occurrence position of pattern, or None when it does not occur
+        if not self.supports(pattern):
+            positions = self.positions(pattern)
+            return int(positions[rng.randrange(len(positions))]) if len(positions) else None
+        lo, hi = self.interval(pattern)
+        return int(self.offsets[self.suffixes[lo + rng.randrange(hi - lo)]]) if hi > lo else None
+
+    def count(self, pattern):
+        # same result as text.count(pattern): leftmost non-overlapping occurrences
+        if self.cache is not None:
+            return self.cache.get((pattern, self.name, 'count'), lambda: self.count_occurrences(pattern))
+        return self.count_occurrences(pattern)
+
+    def count_occurrences(self, pattern):
+        if not self.supports(pattern):
+            return self.text.count(pattern)
+        lo, hi = self.interval(pattern)
+        if hi - lo < 2 or not has_border(pattern, self.bits):
+            return hi - lo
+        count, end = 0, -1
+        for position in np.sort(self.suffixes[lo:hi]).tolist():
+            if position >= end:
+                count += 1
+                end = position + len(pattern) // self.bits
+        return count
+
+    def count_all(self, patterns):
+        counts = {}
+        return [counts[pattern] if pattern in counts else counts.setdefault(pattern, self.count(pattern))
+                for pattern in patterns]
+
+    def contains(self, pattern):
+        if not self.supports(pattern):
+            return pattern in self.text
+        lo, hi = self.interval(pattern)
+        return hi > lo
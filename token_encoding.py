@@ -0,0 +1,131 @@
+import pickle
+import numpy as np
+from storage import is_binary, read_arrays, write_arrays
+
+
+def smallest_dtype(size):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if size <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+class TokenEncoding:
+    # a layout encoding as an array of token ids into a vocabulary of codes, strips[i] = tokens[offsets[i]:offsets[i + 1]]
+    def __init__(self, tokens, vocabulary, offsets, bits=3):
+        self.tokens = tokens
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.bits = bits
+
+    @classmethod
+    def from_string(cls, text, bits=3):
+        pieces = text.split('\t')
+        if any(len(piece) % bits for piece in pieces):
+            raise ValueError('encoding is not aligned to codes')
+        codes = np.frombuffer(''.join(pieces).encode('ascii'), dtype=f'S{bits}')
+        vocabulary, tokens = np.unique(codes, return_inverse=True)
+        offsets = np.cumsum([0] + [len(piece) // bits for piece in pieces]).astype(np.int64)
+        return cls(tokens.ravel().astype(smallest_dtype(len(vocabulary))), vocabulary, offsets, bits)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    @property
+    def n_strips(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.tokens.nbytes + self.vocabulary.nbytes + self.offsets.nbytes
+
+    def strip(self, i):
+        return self.vocabulary[self.tokens[self.offsets[i]:self.offsets[i + 1]]].tobytes().decode('ascii')
+
+    def strips(self):
+        return [self.strip(i) for i in range(self.n_strips)]
+
+    def to_string(self):
+        return '\t'.join(self.strips())
+
+    def encode(self, pattern):
+        # token ids of pattern, None when one of its codes never occurs in this encoding
+        if len(pattern) % self.bits:
+            raise ValueError(f'{pattern!r} is not aligned to codes')
+        codes = np.frombuffer(pattern.encode('ascii'), dtype=f'S{self.bits}')
+        ids = np.minimum(np.searchsorted(self.vocabulary, codes), max(len(self.vocabulary) - 1, 0))
+        if len(self.vocabulary) == 0 or np.any(self.vocabulary[ids] != codes):
+            return None
+        return ids
+
+    def find(self, pattern):
+        # start token of every occurrence of pattern that lies within one strip, overlaps included
+        ids = self.encode(pattern)
+        # patterns longer than the whole encoding cannot occur, and would index past its end below
+        if ids is None or len(ids) == 0 or len(ids) > len(self.tokens):
+            return np.zeros(0, dtype=np.int64)
+        starts = np.flatnonzero(self.tokens[:len(self.tokens) - len(ids) + 1] == ids[0])
+        for k in range(1, len(ids)):
+            starts = starts[self.tokens[starts + k] == ids[k]]
+        strip = np.searchsorted(self.offsets, starts, side='right')
+        return starts[starts + len(ids) <= self.offsets[strip]]
+
+    def occurrences(self, pattern):
+        # leftmost non-overlapping occurrences, the ones str.replace and str.count act on
+        starts = self.find(pattern)
+        size = len(pattern) // self.bits
+        if len(starts) < 2 or np.all(np.diff(starts) >= size):
+            return starts
+        accepted, end = [], -1
+        for start in starts.tolist():
+            if start >= end:
+                accepted.append(start)
+                end = start + size
+        return np.array(accepted, dtype=np.int64)
+
+    def count(self, pattern):
+        return len(self.occurrences(pattern))
+
+    def replace(self, pattern, replacement=''):
+        # replacement is a code string, or '\t' to cut each occurrence out and split its strip there
+        starts = self.occurrences(pattern)
+        size = len(pattern) // self.bits
+        split = replacement == '\t'
+        new_ids = np.zeros(0, dtype=np.int64) if split or replacement == '' else self.encode(replacement)
+        if new_ids is None:
+            raise ValueError(f'{replacement!r} contains codes outside the vocabulary')
+
+        covered = np.zeros(len(self.tokens) + 1, dtype=np.int64)
+        np.add.at(covered, starts, 1)
+        np.add.at(covered, starts + size, -1)
+        tokens = self.tokens[np.cumsum(covered[:-1]) == 0]
+
+        # every earlier occurrence shifts later positions by len(replacement) - len(pattern)
+        removed = starts - size * np.arange(len(starts))
+        if len(new_ids):
+            tokens = np.insert(tokens, np.repeat(removed, len(new_ids)), np.tile(new_ids, len(starts)))
+        shift = len(new_ids) - size
+        offsets = self.offsets + shift * np.searchsorted(starts, self.offsets, side='left')
+        if split:
+            offsets = np.sort(np.concatenate([offsets, removed]))
+        return TokenEncoding(tokens.astype(self.tokens.dtype), self.vocabulary, offsets, self.bits)
+
+
+def load_encoding(filename):
+    # binary token arrays, memory-mapped, as well as the string pickles written by earlier runs and pickled
+    # TokenEncodings
+    if is_binary(filename):
+        stored = read_arrays(filename, 'encoding')
+        return TokenEncoding(stored['tokens'], stored['vocabulary'], stored['offsets'], stored.meta['bits'])
+    with open(filename, 'rb') as f:
+        encoding = pickle.load(f)
+    f.close()
+    return encoding if isinstance(encoding, TokenEncoding) else TokenEncoding.from_string(encoding)
+
+
+def save_encoding(encoding, filename, compress=False):
+    # encoding is a TokenEncoding or a layout encoding string
+    if not isinstance(encoding, TokenEncoding):
+        encoding = TokenEncoding.from_string(encoding)
+    write_arrays(filename, 'encoding', {'tokens': encoding.tokens, 'vocabulary': encoding.vocabulary,
+                                        'offsets': encoding.offsets}, {'bits': encoding.bits}, compress)
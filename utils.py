@@ -1,5 +1,14 @@
 import random
 import string
+import numpy as np
+from token_encoding import TokenEncoding
+from text_index import has_border
+from substring_index import SubstringIndex
+
+# below this many characters a str.replace pass per individual is cheaper than the suffix array lookups
+BATCH_MIN_LENGTH = 65536
+# below this many strings pairwise `in` checks are cheaper than building a SubstringIndex
+SUBSTRING_INDEX_MIN = 1024
 
 
 def create_individual(text, size_bounds, bits=3):
@@ -15,16 +24,20 @@ def create_individual(text, size_bounds, bits=3):
 
 def generate_population(population_size, text, size_bounds, cells):
     population = []
+    present = set()
     while len(population) < population_size - len(cells):
         individual = create_individual(text, size_bounds)
         # if individual not in population and '\t' not in individual:
-        if individual not in population:
+        if individual not in present:
             population.append(individual)
+            present.add(individual)
     population += cells
     return population
 
 
-def count_frequency(population, text):
+def count_frequency(population, text, index=None):
+    if index is not None:
+        return index.count_all(population)
     frequencies = []
     for individual in population:
         frequencies.append(text.count(individual))
@@ -35,6 +48,16 @@ def remove_substrings(strings):
     strings.sort(key=len, reverse=True)
     unique_strings = []
 
+    if len(strings) >= SUBSTRING_INDEX_MIN:
+        # a string is dropped when a longer one contains it or it is a repeat
+        index = SubstringIndex(strings)
+        seen = set()
+        for string in strings:
+            if string not in seen and not index.has_parent(string):
+                unique_strings.append(string)
+            seen.add(string)
+        return unique_strings
+
     for i, string in enumerate(strings):
         if not any(string in other for other in strings[:i]):
             unique_strings.append(string)
@@ -60,6 +83,13 @@ def filter_by_freq(population, frequencies):
 
 def fitness(text, population, frequency):
     sorted_population = sorted(zip(population, frequency), key=lambda x: (x[1], len(x[0])), reverse=True)
+    if isinstance(text, TokenEncoding):
+        # code-aligned replacement on the token array, a match can never start inside a code
+        residual = text
+        for individual in sorted_population:
+            residual = residual.replace(individual[0], '\t')
+        score = 1 - len(residual) / len(text)
+        return score, residual.to_string().replace('\t', '')
     temp_text = text
     for individual in sorted_population:
         sub_string = individual[0]
@@ -69,6 +99,28 @@ def fitness(text, population, frequency):
     return score, temp_text
 
 
+def batch_fitness(text, population, frequency, index, bits=3):
+    # same score and residual as fitness, but occurrences of the whole population come from the strip's
+    # suffix array and are swept over one coverage mask instead of one str.replace pass per individual
+    if len(text) < BATCH_MIN_LENGTH or '\t' in text or not all(index.supports(individual) for individual in population):
+        return fitness(text, population, frequency)
+    sorted_population = sorted(zip(population, frequency), key=lambda x: (x[1], len(x[0])), reverse=True)
+    covered = bytearray(len(text) // bits)
+    for individual, _ in sorted_population:
+        size = len(individual) // bits
+        starts = index.token_positions(individual)
+        if len(starts) > 1 and has_border(individual, bits):
+            # self-overlapping matches are taken leftmost first, like str.replace
+            starts = np.sort(starts)
+        for start in starts.tolist():
+            if covered.find(1, start, start + size) == -1:
+                covered[start:start + size] = b'\x01' * size
+    uncovered = np.frombuffer(covered, dtype=bool) == 0
+    temp_text = np.frombuffer(text.encode('ascii'), dtype=f'S{bits}')[uncovered].tobytes().decode('ascii')
+    score = 1 - len(temp_text) / len(text)
+    return score, temp_text
+
+
 def find_overlap_and_merge(str1, str2, bits=3):
     def get_overlap(s1, s2):
         max_overlap = ''
@@ -94,23 +146,25 @@ def shorten_sequence(string, extend_length, bits=3):
     return [str_shortened, str_shortened_right, str_shortened_left]
 
 
-def extend_sequence(string, extend_length, text, bits=3):
-    try:
+def extend_sequence(string, extend_length, text, bits=3, index=None):
+    if index is not None:
+        starting_pt = index.sample(string)
+    else:
         res = [i for i in range(len(text)) if text.startswith(string, i)]
-        starting_pt = random.sample(res, 1)[0]
-        ending_pt = starting_pt + len(string)
+        starting_pt = random.choice(res) if res else None
+    if starting_pt is None:
+        return ['', '', '']
+    ending_pt = starting_pt + len(string)
 
-        str_extended = text[starting_pt - bits * random.randint(1, extend_length):ending_pt + bits * random.randint(1,
-                                                                                                                    extend_length)]
-        str_extended_left = text[starting_pt - bits * random.randint(1, extend_length):ending_pt]
-        str_extended_right = text[starting_pt:ending_pt + bits * random.randint(1, extend_length)]
+    str_extended = text[starting_pt - bits * random.randint(1, extend_length):ending_pt + bits * random.randint(1,
+                                                                                                                extend_length)]
+    str_extended_left = text[starting_pt - bits * random.randint(1, extend_length):ending_pt]
+    str_extended_right = text[starting_pt:ending_pt + bits * random.randint(1, extend_length)]
 
-        return [str_extended, str_extended_left, str_extended_right]
-    except:
-        return ['', '', '']
+    return [str_extended, str_extended_left, str_extended_right]
 
 
-def mutation(str1, str2, size_bounds, text, bits=3):
+def mutation(str1, str2, size_bounds, text, bits=3, index=None):
     mutated_sequence = [str1, str2]
     extend_length = 10
     overlap, merged_string = find_overlap_and_merge(str1, str2)
@@ -119,16 +173,16 @@ def mutation(str1, str2, size_bounds, text, bits=3):
     else:
         mutated_sequence.extend(shorten_sequence(str1, extend_length))
         mutated_sequence.extend(shorten_sequence(str2, extend_length))
-        mutated_sequence.extend(extend_sequence(str1, extend_length, text))
-        mutated_sequence.extend(extend_sequence(str2, extend_length, text))
+        mutated_sequence.extend(extend_sequence(str1, extend_length, text, index=index))
+        mutated_sequence.extend(extend_sequence(str2, extend_length, text, index=index))
     for element in mutated_sequence:
         if len(element) < bits * size_bounds[0] or len(element) > bits * size_bounds[1] or element[0] in string.digits:
             mutated_sequence.remove(element)
     return mutated_sequence
 
 
-def nextPopulation(population_size, population, size_bounds, text, diversity=0.01, bits=3):
-    frequencies = count_frequency(population, text)
+def nextPopulation(population_size, population, size_bounds, text, diversity=0.01, bits=3, index=None):
+    frequencies = count_frequency(population, text, index)
     filtered_pop, filtered_frequency = filter_by_freq(population, frequencies)
     sorted_pop = [x for _, x in sorted(zip(filtered_frequency, filtered_pop), reverse=True)]
     # wordPool = selection(population, frequencies)
@@ -140,14 +194,14 @@ def nextPopulation(population_size, population, size_bounds, text, diversity=0.0
     while len(newPopulation) < population_size - int(diversity * len(sorted_pop)):
         try:
             parents = random.sample(wordPool, k=2)
-            mutatedWords = mutation(parents[0], parents[1], size_bounds, text)
+            mutatedWords = mutation(parents[0], parents[1], size_bounds, text, index=index)
             newPopulation.extend(mutatedWords)
         except IndexError:
             pass
         except:
             parent = random.choice(wordPool)
             newPopulation.extend(shorten_sequence(parent, 10))
-            newPopulation.extend(extend_sequence(parent, 10, text))
+            newPopulation.extend(extend_sequence(parent, 10, text, index=index))
 
     newPopulation = [x for x in newPopulation if x]
     for p in newPopulation:
@@ -171,16 +225,10 @@ def find_non_overlapping_strings(strings, frequency, bits=3):
     strings = list(frequency_dict.keys())
     strings.sort(key=lambda x: (-frequency_dict.get(x, 0), -len(x)))
     non_overlapping = []
+    # partial overlaps with the strings kept so far, at bits-aligned offsets
+    index = SubstringIndex(bits=bits)
     for s1 in strings:
-        overlap_found = False
-        for s2 in non_overlapping:
-            # Check for partial overlap
-            if any(s1[i:] == s2[:len(s1) - i] for i in range(0, min(len(s1), len(s2)), bits)):
-                overlap_found = True
-                break
-            if any(s2[i:] == s1[:len(s2) - i] for i in range(0, min(len(s1), len(s2)), bits)):
-                overlap_found = True
-                break
-        if not overlap_found:
+        if not index.overlaps(s1):
             non_overlapping.append(s1)
+            index.add(s1)
     return non_overlapping